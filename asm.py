@@ -0,0 +1,187 @@
+op_names = [
+  "label",
+  "push", "pop", "dup", "swap", "rx",
+  "add", "sub", "mul", "div",
+  "lt", "le", "gt", "ge", "eq", "ne",
+  "jle", "jge", "jlt", "jgt", "jeq", "jne", "jz", "jmp",
+  "load", "store",
+  "frame", "end", "call", "ret", "tailcall", "arg", "param",
+  "print",
+  "lload", "lstore", "lea", "addi", "muli", "ldm", "stm",
+  "jlei", "jgei", "jlti", "jgti", "jeqi", "jnei", "linc"
+]
+
+op_code = { name: code for code, name in enumerate(op_names) }
+
+op_label = op_code["label"]
+op_push = op_code["push"]
+op_pop = op_code["pop"]
+op_dup = op_code["dup"]
+op_swap = op_code["swap"]
+op_rx = op_code["rx"]
+op_add = op_code["add"]
+op_sub = op_code["sub"]
+op_mul = op_code["mul"]
+op_div = op_code["div"]
+op_lt = op_code["lt"]
+op_le = op_code["le"]
+op_gt = op_code["gt"]
+op_ge = op_code["ge"]
+op_eq = op_code["eq"]
+op_ne = op_code["ne"]
+op_jle = op_code["jle"]
+op_jge = op_code["jge"]
+op_jlt = op_code["jlt"]
+op_jgt = op_code["jgt"]
+op_jeq = op_code["jeq"]
+op_jne = op_code["jne"]
+op_jz = op_code["jz"]
+op_jmp = op_code["jmp"]
+op_load = op_code["load"]
+op_store = op_code["store"]
+op_frame = op_code["frame"]
+op_end = op_code["end"]
+op_call = op_code["call"]
+op_ret = op_code["ret"]
+op_tailcall = op_code["tailcall"]
+op_arg = op_code["arg"]
+op_param = op_code["param"]
+op_print = op_code["print"]
+
+# superinstructions, selected from common sequences by the peephole pass
+op_lload = op_code["lload"]
+op_lstore = op_code["lstore"]
+op_lea = op_code["lea"]
+op_addi = op_code["addi"]
+op_muli = op_code["muli"]
+op_ldm = op_code["ldm"]
+op_stm = op_code["stm"]
+op_jlei = op_code["jlei"]
+op_jgei = op_code["jgei"]
+op_jlti = op_code["jlti"]
+op_jgti = op_code["jgti"]
+op_jeqi = op_code["jeqi"]
+op_jnei = op_code["jnei"]
+
+# adds an immediate to a local. the operand is an (offset, immediate) pair.
+op_linc = op_code["linc"]
+
+# instructions whose operand is a label until the program is assembled
+op_branch = { op_jle, op_jge, op_jlt, op_jgt, op_jeq, op_jne, op_jz, op_jmp, op_call, op_tailcall }
+
+# compare the top of the stack with an immediate and branch. the operand is
+# an (immediate, label) pair.
+op_branch_imm = { op_jlei, op_jgei, op_jlti, op_jgti, op_jeqi, op_jnei }
+
+reg_names = [ "$fp", "$sp", "$pc" ]
+reg_code = { name: code for code, name in enumerate(reg_names) }
+
+reg_fp = reg_code["$fp"]
+reg_sp = reg_code["$sp"]
+reg_pc = reg_code["$pc"]
+
+class AsmError(Exception):
+  pass
+
+def asm_text(instr):
+  op, operand = instr
+  
+  if op == op_label:
+    return f'__{operand}'
+  elif op == op_rx:
+    return f'rx {reg_names[operand]}'
+  elif operand is None:
+    return op_names[op]
+  elif op in op_branch_imm or op == op_linc:
+    return f'{op_names[op]} {operand[0]} {operand[1]}'
+  else:
+    return f'{op_names[op]} {operand}'
+
+def asm_parse(line):
+  if line.startswith("__"):
+    return (op_label, line[2:])
+  
+  args = line.split()
+  
+  if args[0] not in op_code:
+    raise AsmError(f"unknown instruction '{line}'")
+  
+  op = op_code[args[0]]
+  
+  if len(args) == 1:
+    return (op, None)
+  elif op == op_rx:
+    return (op, reg_code[args[1]])
+  elif op in op_branch:
+    return (op, args[1])
+  elif op in op_branch_imm:
+    return (op, (int(args[1]), args[2]))
+  elif op == op_linc:
+    return (op, (int(args[1]), int(args[2])))
+  else:
+    return (op, int(args[1]))
+
+# a linked program: opcode and operand lists with every label already an
+# instruction offset. the symbol table is only kept to name offsets when
+# disassembling.
+class Program:
+  def __init__(self, ops, operands, symbols, entry):
+    self.ops = ops
+    self.operands = operands
+    self.symbols = symbols
+    self.entry = entry
+  
+  def disassemble(self):
+    return disassemble(self.ops, self.operands, self.symbols)
+
+# resolve labels to instruction offsets once, ahead of the VM, and split the
+# stream into an opcode and an operand list
+def assemble(code, entry="label_main"):
+  ops = []
+  operands = []
+  labels = {}
+  
+  for instr in code:
+    if isinstance(instr, str):
+      instr = asm_parse(instr)
+    
+    op, operand = instr
+    
+    if op == op_label:
+      labels[operand] = len(ops)
+    else:
+      ops.append(op)
+      operands.append(operand)
+  
+  for n, op in enumerate(ops):
+    if op in op_branch:
+      if operands[n] not in labels:
+        raise AsmError(f"undefined label '{operands[n]}'")
+      
+      operands[n] = labels[operands[n]]
+    elif op in op_branch_imm:
+      imm, target = operands[n]
+      
+      if target not in labels:
+        raise AsmError(f"undefined label '{target}'")
+      
+      operands[n] = (imm, labels[target])
+  
+  if entry not in labels:
+    raise AsmError(f"undefined label '{entry}'")
+  
+  return Program(ops, operands, labels, labels[entry])
+
+def disassemble(ops, operands, labels):
+  names = { pos: label for label, pos in labels.items() }
+  lines = []
+  
+  for n, (op, operand) in enumerate(zip(ops, operands)):
+    if op in op_branch:
+      operand = names.get(operand, operand)
+    elif op in op_branch_imm:
+      operand = (operand[0], names.get(operand[1], operand[1]))
+    
+    lines.append(f'{n} {asm_text((op, operand))}')
+  
+  return lines
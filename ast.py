@@ -1,5 +1,10 @@
+import weakref
+from helper import Dispatch
+
 
 class Scope:
+  __slots__ = ("parent", "ret_type", "child", "struct_type", "var", "size", "frame")
+  
   def __init__(self, parent, ret_type=None, attach_parent=True, size=0):
     self.parent = parent
     self.ret_type = ret_type
@@ -7,14 +12,23 @@ class Scope:
     self.struct_type = {}
     self.var = {}
     self.size = size
+    self.frame = self
     
     if self.parent and attach_parent:
       self.ret_type = self.parent.ret_type
       self.parent.child.append(self)
+      self.frame = self.parent.frame
   
   def insert(self, name, node):
     self.var[name] = node
   
+  def alloc(self, var_type):
+    frame = self.frame
+    align = type_alignof(var_type)
+    loc = (frame.size + align - 1) // align * align
+    frame.size = loc + type_sizeof(var_type)
+    return loc
+  
   def find(self, name):
     if name not in self.var:
       if self.parent:
@@ -24,11 +38,19 @@ class Scope:
     
     return self.var[name]
 
-class TypeSpecifier:
-  def __init__(self, specifier, struct_type=None, token=None):
-    self.token = token
+# the type table holds types weakly. the slot lives here so that a type's own
+# __slots__ stay the fields that serial and ast_clone walk
+class Type:
+  __slots__ = ("__weakref__",)
+
+class TypeSpecifier(Type):
+  __slots__ = ("specifier", "struct_type", "byte_size", "align")
+  
+  def __init__(self, specifier, struct_type=None):
     self.specifier = specifier
     self.struct_type = struct_type
+    self.byte_size = None
+    self.align = None
   
   def __repr__(self):
     if self.specifier == "struct":
@@ -36,22 +58,104 @@ class TypeSpecifier:
     else:
       return f'{self.specifier}'
 
-class TypePointer:
+class TypePointer(Type):
+  __slots__ = ("base", "byte_size", "align")
+  
   def __init__(self, base):
     self.base = base
+    self.byte_size = None
+    self.align = None
   
   def __repr__(self):
     return f'{self.base}*'
 
-class TypeArray:
+class TypeArray(Type):
+  __slots__ = ("base", "size", "byte_size", "align")
+  
   def __init__(self, base, size):
     self.base = base
     self.size = size
+    self.byte_size = None
+    self.align = None
   
   def __repr__(self):
     return f'{self.base}[{self.size}]'
 
+# types are hash-consed: every distinct type exists once, so two types are
+# equal exactly when they are the same object. never mutate an interned type.
+# entries are weak so that the types of a struct dropped by a rebuild go with it.
+type_table = weakref.WeakValueDictionary()
+
+def type_specifier(specifier, struct_type=None):
+  key = (specifier, struct_type)
+  var_type = type_table.get(key)
+  
+  if var_type is None:
+    var_type = type_table[key] = TypeSpecifier(specifier, struct_type)
+  
+  return var_type
+
+def type_pointer(base):
+  key = (TypePointer, base)
+  var_type = type_table.get(key)
+  
+  if var_type is None:
+    var_type = type_table[key] = TypePointer(base)
+  
+  return var_type
+
+def type_array(base, size):
+  key = (TypeArray, base, size)
+  var_type = type_table.get(key)
+  
+  if var_type is None:
+    var_type = type_table[key] = TypeArray(base, size)
+  
+  return var_type
+
+def type_intern(var_type):
+  if var_type is None:
+    return None
+  elif isinstance(var_type, TypePointer):
+    return type_pointer(type_intern(var_type.base))
+  elif isinstance(var_type, TypeArray):
+    return type_array(type_intern(var_type.base), var_type.size)
+  else:
+    return type_specifier(var_type.specifier, var_type.struct_type)
+
+type_int = type_specifier("int")
+
+def type_sizeof(var_type):
+  if var_type.byte_size is None:
+    if isinstance(var_type, TypeSpecifier):
+      if var_type.specifier == "int":
+        var_type.byte_size = 4
+      elif var_type.specifier == "struct":
+        var_type.byte_size = var_type.struct_type.size
+    elif isinstance(var_type, TypeArray):
+      var_type.byte_size = var_type.size * type_sizeof(var_type.base)
+    elif isinstance(var_type, TypePointer):
+      var_type.byte_size = 4
+    else:
+      print(var_type)
+      raise Exception("I DONT KNOW THIS ONE!!!")
+  
+  return var_type.byte_size
+
+def type_alignof(var_type):
+  if var_type.align is None:
+    if isinstance(var_type, TypeArray):
+      var_type.align = type_alignof(var_type.base)
+    elif isinstance(var_type, TypeSpecifier) and var_type.specifier == "struct":
+      var_type.align = max([ type_alignof(x.var_type) for x in var_type.struct_type.members ], default=4)
+    else:
+      var_type.align = 4
+  
+  return var_type.align
+
 class AstConstant:
+  __slots__ = ("token", "value", "var_type")
+  
   def __init__(self, value, token, var_type=None):
     self.token = token
     self.value = value
@@ -61,15 +165,20 @@ class AstConstant:
     return self.token.__repr__()
 
 class AstIdentifier:
-  def __init__(self, name, token=None, var_type=None):
+  __slots__ = ("token", "name", "var_type", "decl")
+  
+  def __init__(self, name, token=None, var_type=None, decl=None):
     self.token = token
     self.name = name
     self.var_type = var_type
+    self.decl = decl
   
   def __repr__(self):
     return self.token.__repr__()
 
 class AstIndex:
+  __slots__ = ("base", "pos", "var_type")
+  
   def __init__(self, base, pos, var_type=None):
     self.base = base
     self.pos = pos
@@ -79,11 +188,14 @@ class AstIndex:
     return f'{self.base}[{self.pos}]'
 
 class AstAccess:
-  def __init__(self, base, name, direct=True, var_type=None):
+  __slots__ = ("direct", "base", "name", "var_type", "member")
+  
+  def __init__(self, base, name, direct=True, var_type=None, member=None):
     self.direct = direct
     self.base = base
     self.name = name
     self.var_type = var_type
+    self.member = member
   
   def __repr__(self):
     if self.direct:
@@ -92,6 +204,8 @@ class AstAccess:
       return f'{self.base}->{self.name}'
 
 class AstCall:
+  __slots__ = ("base", "args", "var_type")
+  
   def __init__(self, base, args, var_type=None):
     self.base = base
     self.args = args
@@ -101,6 +215,8 @@ class AstCall:
     return f'{self.base}({", ".join([str(x) for x in self.args])})'
 
 class AstUnaryOp:
+  __slots__ = ("token", "op", "body", "var_type")
+  
   def __init__(self, op, body, token=None, var_type=None):
     self.token = token
     self.op = op
@@ -111,6 +227,8 @@ class AstUnaryOp:
     return f'{self.op}{self.body}'
 
 class AstBinop:
+  __slots__ = ("lhs", "op", "rhs", "token", "var_type")
+  
   def __init__(self, lhs, op, rhs, token=None, var_type=None):
     self.lhs = lhs
     self.op = op
@@ -122,9 +240,12 @@ class AstBinop:
     return f'{self.lhs} {self.op} {self.rhs}'
 
 class AstExpr:
+  __slots__ = ("body", "bracket", "var_type")
+  
   def __init__(self, body, bracket=False, var_type=None):
     self.body = body
     self.bracket = bracket
+    self.var_type = var_type
     
     if not var_type:
       self.var_type = body.var_type
@@ -136,6 +257,8 @@ class AstExpr:
       return f'{self.body}'
 
 class AstVar:
+  __slots__ = ("var_type", "name", "value", "loc")
+  
   def __init__(self, var_type, name, value):
     self.var_type = var_type
     self.name = name
@@ -149,6 +272,8 @@ class AstVar:
       return f'{self.var_type} {self.name}'
 
 class AstStruct:
+  __slots__ = ("name", "members", "scope", "size")
+  
   def __init__(self, name, members, scope=None, size=0):
     self.name = name
     self.members = members
@@ -161,6 +286,8 @@ class AstStruct:
     return f'struct {self.name} {{{members}}}'
 
 class AstFunc:
+  __slots__ = ("var_type", "name", "params", "body", "label")
+  
   def __init__(self, name, params, var_type, body):
     self.var_type = var_type
     self.name = name
@@ -172,6 +299,8 @@ class AstFunc:
     return f'fn {self.name}({", ".join(map(str, self.params))}) {self.body.__repr__(pad=pad)}'
 
 class AstPrintStmt:
+  __slots__ = ("token", "body")
+  
   def __init__(self, token, body):
     self.token = token
     self.body = body
@@ -180,6 +309,8 @@ class AstPrintStmt:
     return ' ' * pad + f'{self.token} {self.body};'
 
 class AstReturnStmt:
+  __slots__ = ("token", "body")
+  
   def __init__(self, token, body):
     self.token = token
     self.body = body
@@ -188,6 +319,8 @@ class AstReturnStmt:
     return ' ' * pad + f'{self.token} {self.body};'
 
 class AstIfStmt:
+  __slots__ = ("cond", "body")
+  
   def __init__(self, cond, body):
     self.cond = cond
     self.body = body
@@ -196,6 +329,8 @@ class AstIfStmt:
     return ' ' * pad + f'if ({self.cond}) {self.body.__repr__(pad=pad+2)};'
 
 class AstWhileStmt:
+  __slots__ = ("cond", "body")
+  
   def __init__(self, cond, body):
     self.cond = cond
     self.body = body
@@ -204,6 +339,8 @@ class AstWhileStmt:
     return ' ' * pad + f'while ({self.cond}) {self.body.__repr__(pad=pad+2)};'
 
 class AstForStmt:
+  __slots__ = ("init", "cond", "step", "body")
+  
   def __init__(self, init, cond, step, body):
     self.init = init
     self.cond = cond
@@ -214,6 +351,8 @@ class AstForStmt:
     return ' ' * pad + f'for ({self.init}; {self.cond}; {self.step}) {self.body.__repr__(pad=pad+2)};'
 
 class AstStmt:
+  __slots__ = ("body",)
+  
   def __init__(self, body):
     self.body = body
   
@@ -221,20 +360,54 @@ class AstStmt:
     return ' ' * pad + f'{self.body};'
 
 class AstBody:
-  def __init__(self, body):
+  __slots__ = ("body", "scope")
+  
+  def __init__(self, body, scope=None):
     self.body = body
-    self.scope = Scope(None)
+    self.scope = scope
   
   def __repr__(self, pad=0):
     return '{\n' + '\n'.join([ stmt.__repr__(pad=pad+2) for stmt in self.body ]) + '\n' + ' ' * pad + '}'
 
 class Ast:
-  def __init__(self, body):
+  __slots__ = ("body", "imports")
+  
+  def __init__(self, body, imports=[]):
     self.body = body
+    self.imports = imports
   
   def __repr__(self):
     return f'{self.body}'
 
+# the fields of each node class and what they hold. ast_children and the
+# optimizer's rewrites follow the node and list fields.
+ast_fields = {
+  Ast: (("body", "node"), ("imports", "tokens")),
+  AstBody: (("body", "list"),),
+  AstStmt: (("body", "node"),),
+  AstPrintStmt: (("token", "token"), ("body", "node")),
+  AstReturnStmt: (("token", "token"), ("body", "node")),
+  AstIfStmt: (("cond", "node"), ("body", "node")),
+  AstWhileStmt: (("cond", "node"), ("body", "node")),
+  AstForStmt: (("init", "node"), ("cond", "node"), ("step", "node"), ("body", "node")),
+  AstFunc: (("name", "token"), ("params", "list"), ("var_type", "node"), ("body", "node")),
+  AstStruct: (("name", "token"), ("members", "list")),
+  AstVar: (("var_type", "node"), ("name", "token"), ("value", "node")),
+  AstExpr: (("body", "node"), ("bracket", "value")),
+  AstBinop: (("lhs", "node"), ("op", "text"), ("rhs", "node"), ("token", "token")),
+  AstUnaryOp: (("op", "text"), ("body", "node"), ("token", "token")),
+  AstCall: (("base", "node"), ("args", "list")),
+  AstAccess: (("base", "node"), ("name", "token"), ("direct", "value")),
+  AstIndex: (("base", "node"), ("pos", "node")),
+  AstIdentifier: (("name", "text"), ("token", "token")),
+  AstConstant: (("value", "value"), ("token", "token")),
+  TypeSpecifier: (("specifier", "text"), ("struct_type", "ref")),
+  TypePointer: (("base", "node"),),
+  TypeArray: (("base", "node"), ("size", "value"))
+}
+
+assign_ops = { "=", "+=", "-=", "*=", "/=" }
+
 def ast_lvalue(node):
   return (
     isinstance(node, AstIdentifier) or \
@@ -244,45 +417,83 @@ def ast_lvalue(node):
     isinstance(node, AstAccess)
   )
 
-def ast_src(node):
-  if isinstance(node, Ast):
-    return ast_src(node.body)
-  elif isinstance(node, AstBody):
-    return ast_src(node.body[0])
-  elif isinstance(node, AstStmt):
-    return ast_src(node.body)
-  elif isinstance(node, AstFunc):
-    return ast_src(node.name)
-  elif isinstance(node, AstPrintStmt):
-    return (node.token.line, node.token.src)
-  elif isinstance(node, AstReturnStmt):
-    return (node.token.line, node.token.src)
-  elif isinstance(node, AstStruct):
-    return (node.name.line, node.name.src)
-  
-  if isinstance(node, AstVar):
-    return ast_src(node.var_type)
-  elif isinstance(node, TypeArray):
-    return ast_src(node.base)
-  elif isinstance(node, TypeSpecifier):
-    return (node.token.line, node.token.src)
-  
-  if isinstance(node, AstExpr):
-    return ast_src(node.body)
-  elif isinstance(node, AstBinop):
-    return ast_src(node.lhs)
-  elif isinstance(node, AstUnaryOp):
-    return (node.token.line, node.token.src)
-  elif isinstance(node, AstIndex):
-    return ast_src(node.base)
-  elif isinstance(node, AstCall):
-    return ast_src(node.base)
-  elif isinstance(node, AstConstant):
-    return (node.token.line, node.token.src)
-  elif isinstance(node, AstIdentifier):
-    return (node.token.line, node.token.src)
-  elif isinstance(node, AstAccess):
-    return ast_src(node.base)
-  
-  print(type(node))
-  raise Exception("I DONT KNOW THIS ONE !!!!!")
+def token_src(node):
+  return (node.token.line, node.token.src)
+
+ast_src = Dispatch("ast_src", {
+  Ast: lambda node: ast_src(node.body),
+  AstBody: lambda node: ast_src(node.body[0]),
+  AstStmt: lambda node: ast_src(node.body),
+  AstFunc: lambda node: (node.name.line, node.name.src),
+  AstPrintStmt: token_src,
+  AstReturnStmt: token_src,
+  AstStruct: lambda node: (node.name.line, node.name.src),
+  AstVar: lambda node: (node.name.line, node.name.src),
+  AstExpr: lambda node: ast_src(node.body),
+  AstBinop: lambda node: ast_src(node.lhs),
+  AstUnaryOp: token_src,
+  AstIndex: lambda node: ast_src(node.base),
+  AstCall: lambda node: ast_src(node.base),
+  AstConstant: token_src,
+  AstIdentifier: token_src,
+  AstAccess: lambda node: ast_src(node.base)
+})
+
+def ast_children(node):
+  for field, encoding in ast_fields.get(type(node), ()):
+    if encoding == "node":
+      child = getattr(node, field)
+      
+      if isinstance(child, list):
+        yield from child
+      elif child is not None:
+        yield child
+    elif encoding == "list":
+      for child in getattr(node, field) or ():
+        if child is not None:
+          yield child
+
+def ast_walk(node):
+  stack = [node]
+  
+  while stack:
+    node = stack.pop()
+    yield node
+    
+    children = list(ast_children(node))
+    children.reverse()
+    stack.extend(children)
+
+clone_kinds = {
+  AstBody, AstStmt, AstPrintStmt, AstReturnStmt, AstIfStmt, AstWhileStmt, AstForStmt,
+  AstExpr, AstBinop, AstUnaryOp, AstCall, AstAccess, AstIndex, AstIdentifier, AstConstant
+}
+
+# copies statements and expressions. declarations and types are shared, and
+# an identifier whose declaration is in decls is replaced by a copy of the
+# expression it maps to. given a scope, each copied body gets a new scope
+# nested in it, so that the copy sits in the scope it is pasted into.
+def ast_clone(node, decls={}, scope=None):
+  kind = type(node)
+  
+  if kind is list:
+    return [ ast_clone(x, decls, scope) for x in node ]
+  
+  if kind not in clone_kinds:
+    return node
+  
+  if kind is AstIdentifier and node.decl in decls:
+    return ast_clone(decls[node.decl])
+  
+  copy = kind.__new__(kind)
+  
+  if kind is AstBody and scope is not None:
+    scope = Scope(scope)
+    copy.scope = scope
+    copy.body = ast_clone(node.body, decls, scope)
+    return copy
+  
+  for slot in kind.__slots__:
+    setattr(copy, slot, ast_clone(getattr(node, slot), decls, scope))
+  
+  return copy
@@ -0,0 +1,511 @@
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from ast import *
+from asm import op_label, op_frame, op_call, op_tailcall
+from lex import MapLex, LexError, TokenBuffer, BufferLex, token_code
+from parse import Parse
+from gen import CodeGen
+from semantic import semantic_pass, ast_stmt, ast_struct, ast_func, SemanticError
+from optimize import optimize_pass, optimize_func, optimize_body
+from peephole import Peephole
+from serial import module_dump, module_load, SerialError
+
+class BuildError(Exception):
+  pass
+
+code_open = { token_code['{'], token_code['('], token_code['['] }
+code_close = { token_code['}'], token_code[')'], token_code[']'] }
+code_brace_open = token_code['{']
+code_brace_close = token_code['}']
+code_semicolon = token_code[';']
+code_identifier = token_code['Identifier']
+code_unit = { token_code['fn'], token_code['struct'] }
+
+class Unit:
+  def __init__(self, kind, name, start, end):
+    self.kind = kind
+    self.name = name
+    self.start = start
+    self.end = end
+    self.refs = set()
+    self.interface = None
+    self.key = None
+  
+  def __repr__(self):
+    return f'{self.kind} {self.name}'
+
+def unit_end(buffer, n):
+  kind = buffer.kind
+  last = len(kind) - 1
+  depth = 0
+  
+  while n < last:
+    code = kind[n]
+    n += 1
+    
+    if code in code_open:
+      depth += 1
+    elif code in code_close:
+      depth -= 1
+      
+      if depth == 0 and code == code_brace_close and kind[n] != code_semicolon:
+        return n
+    elif code == code_semicolon and depth == 0:
+      return n
+  
+  return n
+
+def split_units(buffer):
+  units = []
+  segments = []
+  
+  n = 0
+  
+  while n < len(buffer) - 1:
+    end = unit_end(buffer, n)
+    
+    if buffer.kind[n] in code_unit:
+      units.append(Unit(buffer.token_type(n), buffer.text_at(n + 1), n, end))
+    else:
+      segments.append((n, end))
+    
+    n = end
+  
+  main = Unit("main", "main", 0, n)
+  main.segments = segments
+  
+  return units, main
+
+def unit_text(buffer, start, end):
+  if start >= end:
+    return ""
+  
+  return buffer.text[buffer.start[start]:buffer.end[end - 1]]
+
+def unit_refs(buffer, start, end):
+  kind = buffer.kind
+  return { buffer.text_at(n) for n in range(start, end) if kind[n] == code_identifier }
+
+def digest(*parts):
+  h = hashlib.sha1()
+  
+  for part in parts:
+    h.update(part.encode())
+    h.update(b'\0')
+  
+  return h.hexdigest()
+
+def ref_digest(refs, interface):
+  return [ f'{name}={interface.get(name, "-")}' for name in sorted(refs) ]
+
+class IncrementalBuild:
+  def __init__(self, src):
+    self.src = src
+    self.buffer = None
+    self.cache = {}
+    self.scan_cache = {}
+    self.units = []
+    self.rebuilt = []
+    self.peephole = None
+  
+  def scan_unit(self, buffer, unit):
+    text = unit_text(buffer, unit.start, unit.end)
+    
+    if text not in self.scan_cache:
+      refs = unit_refs(buffer, unit.start, unit.end)
+      refs.discard(unit.name)
+      
+      sig_end = unit.start
+      
+      while sig_end < unit.end and buffer.kind[sig_end] != code_brace_open:
+        sig_end += 1
+      
+      sig_refs = unit_refs(buffer, unit.start, sig_end)
+      sig_refs.discard(unit.name)
+      
+      self.scan_cache[text] = (refs, unit_text(buffer, unit.start, sig_end), sig_refs)
+    
+    return text, self.scan_cache[text]
+  
+  def fingerprint(self, buffer, units, main):
+    interface = {}
+    scan = {}
+    
+    for unit in units:
+      scan[unit] = self.scan_unit(buffer, unit)
+      text, (unit.refs, sig_text, sig_refs) = scan[unit]
+      
+      if unit.kind == "struct":
+        unit.interface = digest(text, *ref_digest(unit.refs, interface))
+        interface[unit.name] = unit.interface
+    
+    for unit in units:
+      text, (refs, sig_text, sig_refs) = scan[unit]
+      
+      if unit.kind == "fn":
+        unit.interface = digest(sig_text, *ref_digest(sig_refs, interface))
+        interface[unit.name] = unit.interface
+    
+    for unit in units:
+      text, (refs, sig_text, sig_refs) = scan[unit]
+      unit.key = digest(text, *ref_digest(refs, interface))
+    
+    main.refs = set()
+    text = []
+    
+    for start, end in main.segments:
+      main.refs |= unit_refs(buffer, start, end)
+      text.append(unit_text(buffer, start, end))
+    
+    main.key = digest(*text, *ref_digest(main.refs, interface))
+  
+  def build(self):
+    file = open(self.src)
+    text = file.read()
+    file.close()
+    
+    if self.buffer:
+      buffer = self.buffer.update(text)
+    else:
+      buffer = TokenBuffer(text, self.src)
+    
+    if buffer.kind[0] == token_code["import"]:
+      raise BuildError(f"{self.src}: incremental builds do not support imports")
+    
+    units, main = split_units(buffer)
+    self.fingerprint(buffer, units, main)
+    
+    lex = BufferLex(self.src, buffer)
+    parse = Parse(lex)
+    scope = Scope(None)
+    
+    cache = {}
+    rebuilt = []
+    chunks = []
+    stmts = []
+    
+    segments = [ (start, end, main) for start, end in main.segments ]
+    segments += [ (unit.start, unit.end, unit) for unit in units ]
+    segments.sort(key=lambda x: x[0])
+    
+    main_cached = self.cache.get((main.kind, main.name))
+    main_dirty = not main_cached or main_cached[0] != main.key
+    
+    for start, end, unit in segments:
+      if unit is main:
+        if main_dirty:
+          lex.seek(start)
+          
+          while lex.index < end:
+            stmts += ast_stmt(scope, parse.parse_stmt())
+        
+        continue
+      
+      cached = self.cache.get((unit.kind, unit.name))
+      
+      if cached and cached[0] == unit.key:
+        key, node, code = cached
+        
+        if unit.kind == "struct":
+          scope.struct_type[unit.name] = node
+          parse.struct_types[unit.name] = node
+        else:
+          scope.insert(unit.name, node)
+          node.body.scope.parent = scope
+          chunks.append(code)
+        
+        cache[(unit.kind, unit.name)] = cached
+        continue
+      
+      lex.seek(start)
+      code_gen = CodeGen()
+      
+      if unit.kind == "struct":
+        node = parse.parse_struct()
+        ast_struct(scope, node)
+      else:
+        node = parse.parse_function()
+        ast_func(scope, node)
+        optimize_func(node)
+        code_gen.gen_func(node)
+        chunks.append(code_gen.code)
+      
+      cache[(unit.kind, unit.name)] = (unit.key, node, code_gen.code)
+      rebuilt.append(unit)
+    
+    if main_dirty:
+      body = optimize_body(AstBody(stmts, scope))
+      
+      code_gen = CodeGen()
+      code_gen.gen_main(body)
+      
+      main_cached = (main.key, body, code_gen.code)
+      rebuilt.append(main)
+    
+    cache[(main.kind, main.name)] = main_cached
+    chunks.append(main_cached[2])
+    
+    self.buffer = buffer
+    self.cache = cache
+    self.units = units + [main]
+    self.rebuilt = rebuilt
+    
+    self.peephole = Peephole()
+    
+    return self.peephole.run([ instr for chunk in chunks for instr in chunk ])
+
+class Module:
+  def __init__(self, name, src, imports):
+    self.name = name
+    self.src = src
+    self.imports = imports
+    self.key = None
+    self.interface = None
+    self.code = None
+  
+  def __repr__(self):
+    return self.name
+
+def module_name(src):
+  return os.path.splitext(os.path.basename(src))[0]
+
+def cache_path(src):
+  return os.path.splitext(src)[0] + '.9ca'
+
+def scan_imports(src):
+  return [ token.text for token in Parse(MapLex(src)).parse_imports() ]
+
+def module_interface(node):
+  structs = list(node.body.scope.struct_type.values())
+  fns = []
+  
+  for var in node.body.scope.var.values():
+    if isinstance(var, AstFunc):
+      fn = AstFunc(var.name, var.params, var.var_type, None)
+      fn.label = var.label
+      fns.append(fn)
+  
+  return (structs, fns)
+
+# every interface arrives as its own copy, so a struct reached through two
+# imports has two objects. map each one to a single canonical struct so the
+# interned types built on it compare by identity.
+def import_struct(struct_type, canonical):
+  key = (struct_type.name.src, struct_type.name.text)
+  
+  if key not in canonical:
+    canonical[key] = struct_type
+    
+    for member in struct_type.members:
+      member.var_type = import_type(member.var_type, canonical)
+  
+  return canonical[key]
+
+def import_type(var_type, canonical):
+  if var_type is None:
+    return None
+  elif isinstance(var_type, TypePointer):
+    return type_pointer(import_type(var_type.base, canonical))
+  elif isinstance(var_type, TypeArray):
+    return type_array(import_type(var_type.base, canonical), var_type.size)
+  elif var_type.specifier == "struct":
+    return type_specifier("struct", import_struct(var_type.struct_type, canonical))
+  else:
+    return type_specifier(var_type.specifier)
+
+def compile_module(src, module, imports, inits=[], key=None):
+  try:
+    parse = Parse(MapLex(src))
+    import_scope = Scope(None)
+    
+    canonical = {}
+    
+    for structs, fns in imports:
+      for struct_type in structs:
+        struct_type = import_struct(struct_type, canonical)
+        parse.struct_types[struct_type.name.text] = struct_type
+        import_scope.struct_type[struct_type.name.text] = struct_type
+      
+      for fn in fns:
+        for param in fn.params:
+          param.var_type = import_type(param.var_type, canonical)
+        
+        fn.var_type = import_type(fn.var_type, canonical)
+        import_scope.insert(fn.name.text, fn)
+    
+    node = parse.parse()
+    
+    if not node:
+      node = Ast(AstBody([]))
+    
+    node.body.scope = Scope(import_scope, attach_parent=False)
+    node = semantic_pass(node)
+    node = optimize_pass(node, entry=not module)
+    
+    code_gen = CodeGen(node, module=module, inits=inits)
+  except (LexError, SemanticError) as e:
+    raise BuildError(str(e))
+  
+  interface = module_interface(node)
+  
+  if key:
+    module_dump(cache_path(src), key, interface, code_gen.code, node)
+  
+  return interface, code_gen.code
+
+def link(modules):
+  code = []
+  labels = set()
+  
+  for module in modules:
+    for instr in module.code:
+      if instr[0] == op_label:
+        if instr[1] in labels:
+          raise BuildError(f"{module.src}: duplicate label '{instr[1]}' while linking")
+        
+        labels.add(instr[1])
+      
+      code.append(instr)
+  
+  return link_prune(code)
+
+# drop the functions of imported modules that nothing calls. every function and
+# module main starts with its label followed by a frame instruction.
+def link_prune(code, entry="label_main"):
+  chunks = {}
+  order = []
+  
+  for n, instr in enumerate(code):
+    if instr[0] == op_label and n + 1 < len(code) and code[n + 1][0] == op_frame:
+      order.append(instr[1])
+      chunks[instr[1]] = []
+    
+    chunks[order[-1]].append(instr)
+  
+  reachable = { entry }
+  work = [entry]
+  
+  while work:
+    for op, operand in chunks.get(work.pop(), ()):
+      if (op == op_call or op == op_tailcall) and operand not in reachable:
+        reachable.add(operand)
+        work.append(operand)
+  
+  return [ instr for name in order if name in reachable for instr in chunks[name] ]
+
+class ModuleBuild:
+  def __init__(self, src, jobs=None, cache=False):
+    self.src = src
+    self.jobs = jobs
+    self.cache = cache
+    self.modules = {}
+    self.order = []
+    self.peephole = Peephole()
+  
+  def discover(self):
+    root = module_name(self.src)
+    modules = {}
+    pending = [ (root, self.src) ]
+    
+    while pending:
+      name, src = pending.pop()
+      
+      if name in modules:
+        continue
+      
+      if not os.path.exists(src):
+        raise BuildError(f"{src}: module '{name}' not found")
+      
+      modules[name] = Module(name, src, scan_imports(src))
+      
+      for dep in modules[name].imports:
+        pending.append((dep, os.path.join(os.path.dirname(src), f'{dep}.9c')))
+    
+    order = []
+    state = {}
+    
+    def visit(name, path):
+      if state.get(name) == "done":
+        return
+      
+      if state.get(name) == "visiting":
+        raise BuildError(f"import cycle: {' -> '.join(path + [name])}")
+      
+      state[name] = "visiting"
+      
+      for dep in modules[name].imports:
+        visit(dep, path + [name])
+      
+      state[name] = "done"
+      order.append(modules[name])
+    
+    visit(root, [])
+    
+    self.modules = modules
+    self.order = order
+    
+    return modules[root]
+  
+  def build(self):
+    root = self.discover()
+    inits = [ f'{module.name}:label_main' for module in self.order if module is not root ]
+    
+    if self.cache:
+      for module in self.order:
+        file = open(module.src)
+        text = file.read()
+        file.close()
+        
+        deps = [ self.modules[dep].key for dep in module.imports ]
+        
+        if module is root:
+          module.key = digest(text, "", *deps, *inits)
+        else:
+          module.key = digest(text, module.name, *deps)
+    
+    done = set()
+    running = {}
+    
+    if self.cache:
+      for module in self.order:
+        try:
+          compiled = module_load(cache_path(module.src), module.key)
+        except (OSError, SerialError):
+          continue
+        
+        if module is not root:
+          module.interface = compiled.interface()
+        
+        module.code = compiled.code
+        done.add(module.name)
+    
+    if len(done) == len(self.order):
+      return self.peephole.run(link(self.order))
+    
+    with ProcessPoolExecutor(self.jobs) as pool:
+      while len(done) < len(self.order):
+        for module in self.order:
+          if module.name in done or module in running.values():
+            continue
+          
+          if not all([ dep in done for dep in module.imports ]):
+            continue
+          
+          imports = [ self.modules[dep].interface for dep in module.imports ]
+          
+          if module is root:
+            future = pool.submit(compile_module, module.src, None, imports, inits, module.key)
+          else:
+            future = pool.submit(compile_module, module.src, module.name, imports, [], module.key)
+          
+          running[future] = module
+        
+        finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        
+        for future in finished:
+          module = running.pop(future)
+          module.interface, module.code = future.result()
+          done.add(module.name)
+    
+    return self.peephole.run(link(self.order))
@@ -0,0 +1,257 @@
+from tac import *
+
+# terminators control never falls through
+tac_exits = { tac_jmp, tac_ret, tac_tailcall }
+
+class Block:
+  def __init__(self, label):
+    self.label = label
+    self.code = []
+    self.next = None
+  
+  def term(self):
+    if self.code and (self.code[-1][0] in tac_branch or self.code[-1][0] in tac_exits):
+      return self.code[-1]
+    
+    return None
+  
+  # control leaves through the terminator or falls through to next
+  def ends(self):
+    term = self.term()
+    return term is not None and term[0] in tac_exits
+  
+  def succ(self):
+    term = self.term()
+    
+    if term is None:
+      return [ self.next ] if self.next else []
+    elif term[0] in (tac_ret, tac_tailcall):
+      return []
+    elif term[0] == tac_jmp:
+      return [ term[1] ]
+    else:
+      return [ term[3], self.next ] if self.next else [ term[3] ]
+  
+  def __repr__(self):
+    return f'Block({self.label})'
+
+# a function, or the main body, as basic blocks. the first block is the entry.
+class Unit:
+  def __init__(self, label, enter):
+    self.label = label
+    self.enter = enter
+    self.blocks = []
+    self.made = 0
+  
+  def block_map(self):
+    return { block.label: block for block in self.blocks }
+  
+  def preds(self):
+    preds = { block.label: [] for block in self.blocks }
+    
+    for block in self.blocks:
+      for label in block.succ():
+        preds[label].append(block)
+    
+    return preds
+  
+  # a fresh register, starting out as value
+  def new_reg(self, value=0):
+    op, size, template, args = self.enter
+    self.enter = (op, size, template + [ value ], args)
+    return len(template)
+  
+  # the value of a register no instruction writes and no argument lands in
+  def constant(self, r):
+    op, size, template, args = self.enter
+    
+    if r < args:
+      return None
+    
+    for block in self.blocks:
+      for instr in block.code:
+        if tac_def(instr) == r:
+          return None
+    
+    return template[r]
+  
+  # a block that runs once before the loop at header. edges entering the loop
+  # from outside go through it.
+  def preheader(self, header, body):
+    outside = [ block for block in self.preds()[header] if block.label not in body ]
+    
+    self.made += 1
+    pre = Block(f'{self.label}.{self.made}')
+    pre.next = header
+    
+    for block in outside:
+      term = block.term()
+      
+      if term is not None and term[0] == tac_jmp and term[1] == header:
+        block.code[-1] = (tac_jmp, pre.label, None, None)
+      elif term is not None and term[0] in tac_branch and term[3] == header:
+        block.code[-1] = (term[0], term[1], term[2], pre.label)
+      
+      if block.next == header:
+        block.next = pre.label
+    
+    # sit after the one block coming in unless that would break its
+    # fallthrough, so the loop itself keeps its layout
+    if len(outside) == 1 and (outside[0].next is None or outside[0].next == pre.label):
+      self.blocks.insert(self.blocks.index(outside[0]) + 1, pre)
+    else:
+      self.blocks.insert(self.blocks.index(self.block_map()[header]), pre)
+    
+    return pre
+  
+  def new_block(self, label=None):
+    self.made += 1
+    block = Block(label or f'{self.label}.{self.made}')
+    
+    if self.blocks and not self.blocks[-1].ends():
+      self.blocks[-1].next = block.label
+    
+    self.blocks.append(block)
+    return block
+  
+  def __repr__(self):
+    return f'Unit({self.label}, {self.blocks})'
+
+# split a TAC stream into units at a label followed by enter, and each unit
+# into blocks at labels and after branches
+def cfg_build(code):
+  units = []
+  unit = None
+  block = None
+  n = 0
+  
+  while n < len(code):
+    instr = code[n]
+    
+    if instr[0] == tac_label and n + 1 < len(code) and code[n + 1][0] == tac_enter:
+      unit = Unit(instr[1], code[n + 1])
+      units.append(unit)
+      block = None
+      n += 2
+      continue
+    
+    if instr[0] == tac_label:
+      block = unit.new_block(instr[1])
+    else:
+      if block is None or block.term() is not None:
+        block = unit.new_block()
+      
+      block.code.append(instr)
+    
+    n += 1
+  
+  return units
+
+def cfg_lower(units):
+  code = []
+  
+  for unit in units:
+    code.append((tac_label, unit.label, None, None))
+    code.append(unit.enter)
+    
+    for n, block in enumerate(unit.blocks):
+      following = unit.blocks[n + 1].label if n + 1 < len(unit.blocks) else None
+      
+      code.append((tac_label, block.label, None, None))
+      
+      term = block.term()
+      
+      if term is not None and term[0] == tac_jmp and term[1] == following:
+        code += block.code[:-1]
+      else:
+        code += block.code
+      
+      if block.next is not None and block.next != following:
+        code.append((tac_jmp, block.next, None, None))
+  
+  return code
+
+# registers live on entry to each block
+def cfg_liveness(unit):
+  gen = {}
+  kill = {}
+  
+  for block in unit.blocks:
+    used = set()
+    defined = set()
+    
+    for instr in block.code:
+      used.update([ r for r in tac_uses(instr) if r not in defined ])
+      
+      if tac_def(instr) is not None:
+        defined.add(tac_def(instr))
+    
+    gen[block.label] = used
+    kill[block.label] = defined
+  
+  live_in = { block.label: set() for block in unit.blocks }
+  changed = True
+  
+  while changed:
+    changed = False
+    
+    for block in reversed(unit.blocks):
+      out = set()
+      
+      for label in block.succ():
+        out |= live_in[label]
+      
+      new = gen[block.label] | (out - kill[block.label])
+      
+      if new != live_in[block.label]:
+        live_in[block.label] = new
+        changed = True
+  
+  return live_in
+
+def cfg_dominators(unit):
+  labels = [ block.label for block in unit.blocks ]
+  preds = unit.preds()
+  dom = { label: set(labels) for label in labels }
+  dom[labels[0]] = { labels[0] }
+  changed = True
+  
+  while changed:
+    changed = False
+    
+    for block in unit.blocks[1:]:
+      new = { block.label }
+      
+      if preds[block.label]:
+        new |= set.intersection(*[ dom[pred.label] for pred in preds[block.label] ])
+      
+      if new != dom[block.label]:
+        dom[block.label] = new
+        changed = True
+  
+  return dom
+
+# natural loops as { header: labels of the blocks in the loop }. loops
+# sharing a header are one loop.
+def cfg_loops(unit):
+  if not unit.blocks:
+    return {}
+  
+  dom = cfg_dominators(unit)
+  preds = unit.preds()
+  loops = {}
+  
+  for block in unit.blocks:
+    for header in block.succ():
+      if header in dom[block.label]:
+        body = loops.setdefault(header, { header })
+        work = [ block.label ]
+        
+        while work:
+          label = work.pop()
+          
+          if label not in body:
+            body.add(label)
+            work += [ pred.label for pred in preds[label] ]
+  
+  return loops
@@ -1,19 +1,104 @@
+import os
+import sys
+import time
 from vm import VM
-from lex import Lex, LexError
+from asm import assemble, AsmError
+from lex import MapLex, LexError
 from parse import Parse
 from gen import CodeGen
 from semantic import semantic_pass, SemanticError
+from optimize import optimize_pass
+from peephole import Peephole
+from tacgen import TacGen
+from tac import tac_assemble
+from tacvm import TacVM
+from passes import PassManager
+from build import IncrementalBuild, ModuleBuild, BuildError, scan_imports
 
-try:
-  lex = Lex("main.9c")
-  node = Parse(lex).parse()
+def watch(src, stats):
+  build = IncrementalBuild(src)
+  mtime = None
+  
+  while True:
+    stat = os.stat(src).st_mtime_ns
+    
+    if stat != mtime:
+      mtime = stat
+      
+      try:
+        start = time.perf_counter()
+        code = build.build()
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        print(f'built {src} in {elapsed:.1f}ms ({len(build.rebuilt)}/{len(build.units)} units rebuilt)')
+        
+        if stats:
+          print(f'peephole: {build.peephole.report()}')
+        
+        VM(assemble(code)).run()
+      except (LexError, SemanticError, BuildError, AsmError) as e:
+        print(e)
+    
+    time.sleep(0.1)
 
-  node = semantic_pass(node)
+def run_stack(src, stats, cache):
+  if cache or scan_imports(src):
+    build = ModuleBuild(src, cache=cache)
+    code = build.build()
+    peephole = build.peephole
+  else:
+    lex = MapLex(src)
+    node = Parse(lex).parse()
+    
+    node = semantic_pass(node)
+    node = optimize_pass(node)
+    
+    peephole = Peephole()
+    code = peephole.run(CodeGen(node).code)
+  
+  if stats:
+    print(f'peephole: {peephole.report()}')
+  
+  vm = VM(assemble(code))
+  vm.dump()
+  vm.run()
 
-  code_gen = CodeGen(node)
+def run_reg(src, stats, disabled):
+  if scan_imports(src):
+    raise BuildError(f"{src}: the register backend does not link modules yet")
+  
+  node = optimize_pass(semantic_pass(Parse(MapLex(src)).parse()))
+  passes = PassManager()
   
-  vm = VM(code_gen.code)
+  for name in disabled:
+    if name not in passes.enabled:
+      raise BuildError(f"unknown pass '{name}'")
+    
+    passes.disable(name)
+  
+  code = passes.run(TacGen(node).code)
+  
+  if stats:
+    print(f'passes: {passes.report()}')
+  
+  vm = TacVM(tac_assemble(code))
   vm.dump()
   vm.run()
-except (LexError, SemanticError) as e:
+
+# cirno.py [--watch] [--cache] [--reg] [--stats] [--no-<pass>] [file]
+args = [ arg for arg in sys.argv[1:] if not arg.startswith("--") ]
+flags = [ arg for arg in sys.argv[1:] if arg.startswith("--") ]
+
+src = args[0] if args else "main.9c"
+stats = "--stats" in flags
+disabled = [ flag[5:] for flag in flags if flag.startswith("--no-") ]
+
+try:
+  if "--watch" in flags:
+    watch(src, stats)
+  elif "--reg" in flags:
+    run_reg(src, stats, disabled)
+  else:
+    run_stack(src, stats, "--cache" in flags)
+except (LexError, SemanticError, BuildError, AsmError) as e:
   print(e)
@@ -1,100 +1,160 @@
 from ast import *
-from semantic import var_type_cmp
+from asm import *
+from helper import Dispatch
+from optimize import frame_escapes, strip_brackets, step_value, loop_ivs
+
+arith_ops = { "+": op_add, "-": op_sub, "*": op_mul, "/": op_div }
+cmp_ops = { "<": op_lt, "<=": op_le, ">": op_gt, ">=": op_ge, "==": op_eq, "!=": op_ne }
+
+# the branch taken when a comparison is false
+false_branch = { "<": op_jge, "<=": op_jgt, ">": op_jle, ">=": op_jlt, "==": op_jne, "!=": op_jeq }
 
 class CodeGen:
-  def __init__(self, node):
+  def __init__(self, node=None, module=None, inits=[]):
     self.code = []
+    self.module = module
+    self.inits = inits
+    self.lbl_prefix = f'{module}:' if module else ''
+    self.lbl_unit = f'{self.lbl_prefix}label'
     self.lbl_name = 0
-    self.lbl_main = 'label_main'
+    self.lbl_main = f'{self.lbl_prefix}label_main'
     self.scope = None
     self.ax = 0
-    self.gen_body(node.body)
-  
-  def var_alloc(self, scope):
-    for var in scope.var.values():
-      if isinstance(var, AstVar):
-        var.loc = scope.size
-        scope.size += type_sizeof(var.var_type)
-    
-    for child in scope.child:
-      child.size = scope.size
-      self.var_alloc(child)
-      scope.size = child.size
+    self.tail_calls = False
+    self.fn = None
+    self.frame_scope = None
+    self.extra = 0
+    self.taken = set()
+    self.iv_ptrs = {}
+    
+    self.stmt_rule = Dispatch("gen_stmt", {
+      AstPrintStmt: self.gen_print_stmt,
+      AstReturnStmt: self.gen_return_stmt,
+      AstIfStmt: self.gen_if_stmt,
+      AstWhileStmt: self.gen_while_stmt,
+      AstForStmt: self.gen_for_stmt,
+      AstStmt: self.gen_expr_stmt
+    })
+    
+    self.expr_rule = Dispatch("gen_expr", {
+      AstExpr: self.gen_bracket,
+      AstBinop: self.gen_binop,
+      AstUnaryOp: self.gen_unary_op,
+      AstConstant: self.gen_constant,
+      AstCall: self.gen_call,
+      AstIdentifier: self.gen_value,
+      AstIndex: self.gen_value,
+      AstAccess: self.gen_value
+    })
+    
+    self.lvalue_rule = Dispatch("gen_lvalue", {
+      AstIdentifier: self.gen_lvalue_identifier,
+      AstIndex: self.gen_lvalue_index,
+      AstUnaryOp: self.gen_lvalue_deref,
+      AstAccess: self.gen_lvalue_access
+    })
+    
+    if node:
+      self.gen_body(node.body)
   
   def gen_body(self, node):
-    for struct_type in node.scope.struct_type.values():
-      self.var_alloc(struct_type.scope)
-      struct_type.size = struct_type.scope.size
-    
     for fn in node.scope.var.values():
-      if isinstance(fn, AstFunc):
+      if isinstance(fn, AstFunc) and fn.body:
         self.gen_func(fn)
     
+    self.gen_main(node)
+  
+  # the unit's own scope holds its frame size. self.scope moves through
+  # the nested bodies as they are generated.
+  def begin_unit(self, fn, body):
+    self.fn = fn
+    self.frame_scope = body.scope
+    self.extra = 0
+    self.iv_ptrs = {}
+    self.taken = set()
+    
+    for expr in ast_walk(body):
+      if isinstance(expr, AstUnaryOp) and expr.op == '&' and isinstance(strip_brackets(expr.body), AstIdentifier):
+        self.taken.add(strip_brackets(expr.body).decl)
+  
+  # frame space past the locals, for loop pointers
+  def alloc_extra(self, var_type):
+    align = type_alignof(var_type)
+    loc = (self.frame_scope.size + self.extra + align - 1) // align * align
+    self.extra = loc + type_sizeof(var_type) - self.frame_scope.size
+    return loc
+  
+  def gen_main(self, node):
     self.scope = node.scope
+    self.tail_calls = False
+    self.lbl_unit = f'{self.lbl_prefix}label'
+    self.lbl_name = 0
+    self.begin_unit(None, node)
     
-    self.var_alloc(self.scope)
     self.emit_label(self.lbl_main)
-    self.emit(f'frame {self.scope.size}')
+    frame_at = len(self.code)
+    self.emit(op_frame, self.scope.size)
+    
+    for init in self.inits:
+      self.emit(op_call, init)
     
     for stmt in node.body:
       self.gen_stmt(stmt)
     
-    self.emit(f'end')
+    self.code[frame_at] = (op_frame, self.frame_scope.size + self.extra)
+    self.emit(op_end)
+    
+    if self.module:
+      self.emit(op_ret)
   
   def gen_func(self, fn):
     self.scope = fn.body.scope
     
-    self.var_alloc(self.scope)
-    
-    fn.label = self.label()
+    fn.label = f'{self.lbl_prefix}fn.{fn.name.text}'
+    self.lbl_unit = fn.label
+    self.lbl_name = 0
     self.lbl_ret = self.label()
+    self.tail_calls = not frame_escapes(fn)
+    self.begin_unit(fn, fn.body)
     
     param_size = 0
     
     self.emit_label(fn.label)
-    self.emit(f'frame {self.scope.size + param_size}')
+    frame_at = len(self.code)
+    self.emit(op_frame, self.scope.size + param_size)
     
     for param in fn.params:
       param_size += type_sizeof(param.var_type)
     
     if param_size > 0:
-      self.emit(f'param {param_size}')
-      self.emit('rx $fp')
-      self.emit(f'store {param_size}')
+      self.emit(op_param, param_size)
+      self.emit(op_rx, reg_fp)
+      self.emit(op_store, param_size)
     
     self.gen_compound_stmt(fn.body)
     
+    self.code[frame_at] = (op_frame, self.frame_scope.size + self.extra)
     self.emit_label(self.lbl_ret)
-    self.emit(f'end')
-    self.emit(f'ret')
+    self.emit(op_end)
+    self.emit(op_ret)
   
   def gen_stmt(self, node):
-    if isinstance(node, AstPrintStmt):
-      self.gen_print_stmt(node)
-    elif isinstance(node, AstReturnStmt):
-      self.gen_return_stmt(node)
-    elif isinstance(node, AstIfStmt):
-      self.gen_if_stmt(node)
-    elif isinstance(node, AstWhileStmt):
-      self.gen_while_stmt(node)
-    elif isinstance(node, AstForStmt):
-      self.gen_for_stmt(node)
-    elif isinstance(node, AstStmt):
-      if isinstance(node.body, AstExpr):
-        self.gen_expr(node.body)
-      else:
-        raise Exception("NOT DONE YET BAKA")
-    else:
-      raise Exception("NOT DONE YET BAKA")
+    self.stmt_rule[type(node)](node)
     
     for i in range(self.ax):
-      self.emit('pop')
+      self.emit(op_pop)
     
     self.ax = 0
   
+  def gen_expr_stmt(self, node):
+    if isinstance(node.body, AstExpr):
+      self.gen_expr(node.body)
+    else:
+      raise Exception("NOT DONE YET BAKA")
+  
   def gen_if_stmt(self, node):
     lbl_end = self.label()
-
+    
     self.scope = node.body.scope
     
     self.gen_cmp_cond(node.cond, lbl_end)
@@ -108,13 +168,15 @@ class CodeGen:
     lbl_end = self.label()
     
     self.scope = node.body.scope
+    outer = self.gen_loop_ptrs([ node.cond, node.body ])
     
     self.emit_label(lbl_cond)
     self.gen_cmp_cond(node.cond, lbl_end)
     self.gen_compound_stmt(node.body)
-    self.emit(f'jmp {lbl_cond}')
+    self.emit(op_jmp, lbl_cond)
     self.emit_label(lbl_end)
     
+    self.iv_ptrs = outer
     self.scope = node.body.scope.parent
   
   def gen_for_stmt(self, node):
@@ -126,6 +188,7 @@ class CodeGen:
     
     lbl_cond = self.label()
     lbl_end = self.label()
+    outer = self.gen_loop_ptrs([ node.cond, node.body, node.step ])
     
     self.emit_label(lbl_cond)
     self.gen_cmp_cond(node.cond, lbl_end)
@@ -133,109 +196,212 @@ class CodeGen:
     self.gen_compound_stmt(node.body)
     
     self.gen_expr(node.step)
-    self.emit(f'jmp {lbl_cond}')
+    self.emit(op_jmp, lbl_cond)
     
     self.emit_label(lbl_end)
     
+    self.iv_ptrs = outer
     self.scope = node.body.scope.parent
   
   def gen_print_stmt(self, node):
     self.gen_expr(node.body)
-    self.emit('print')
+    self.emit(op_print)
     self.ax -= 1
   
   def gen_return_stmt(self, node):
+    call = node.body.body if isinstance(node.body, AstExpr) else node.body
+    
+    if self.tail_calls and isinstance(call, AstCall):
+      self.gen_tail_call(call)
+      return
+    
     if node.body:
       type_size = type_sizeof(node.body.var_type)
       self.gen_expr(node.body)
       
-      self.emit(f'arg {type_size}')
+      self.emit(op_arg, type_size)
       
       self.ax -= type_size // 4
     
-    self.emit(f'jmp {self.lbl_ret}')
+    self.emit(op_jmp, self.lbl_ret)
+  
+  # the frame is torn down before the jump, so the callee returns straight to
+  # our caller with its result
+  def gen_tail_call(self, node):
+    arg_size = 0
+    
+    for arg in node.args:
+      self.gen_expr(arg)
+      arg_size += type_sizeof(arg.var_type)
+    
+    if arg_size > 0:
+      self.emit(op_arg, arg_size)
+    
+    self.ax -= arg_size // 4
+    
+    self.emit(op_tailcall, node.base.decl.label)
   
   def gen_compound_stmt(self, node):
     for stmt in node.body:
       self.gen_stmt(stmt)
   
   def gen_lvalue(self, node):
-    if isinstance(node, AstIdentifier):
-      loc = self.scope.find(node.name).loc
-      self.emit(f'push {loc}')
-      self.emit(f'rx $fp')
-      self.emit(f'add')
-      self.ax += 1
-    elif isinstance(node, AstIndex):
+    self.lvalue_rule[type(node)](node)
+  
+  def gen_lvalue_identifier(self, node):
+    self.emit(op_push, node.decl.loc)
+    self.emit(op_rx, reg_fp)
+    self.emit(op_add)
+    self.ax += 1
+  
+  # an array is indexed from its address, a pointer from its value
+  def gen_index_base(self, node):
+    if isinstance(node.var_type, TypeArray):
+      self.gen_lvalue(node)
+    else:
+      self.gen_expr(node)
+  
+  # (array, iv) for a[i] with a an array variable and i an induction variable
+  def index_key(self, node):
+    base = strip_brackets(node.base)
+    pos = strip_brackets(node.pos)
+    
+    if isinstance(base, AstIdentifier) and isinstance(base.var_type, TypeArray) and isinstance(pos, AstIdentifier):
+      return (base.decl, pos.decl)
+    
+    return None
+  
+  # a[i] inside a loop that only steps i by constants gets a frame slot
+  # holding its address. the slot is set up before the loop and stepped
+  # with i, so the loop reads the address instead of computing i * size + a.
+  # returns the slots of the enclosing loops, to restore after this one.
+  def gen_loop_ptrs(self, parts):
+    outer = self.iv_ptrs
+    nodes = [ node for part in parts if part is not None for node in ast_walk(part) ]
+    
+    # in main a call may write any global
+    if self.fn is None and any([ isinstance(node, AstCall) for node in nodes ]):
+      return outer
+    
+    ivs = loop_ivs(nodes) - self.taken
+    self.iv_ptrs = dict(outer)
+    
+    for node in nodes:
+      key = self.index_key(node) if isinstance(node, AstIndex) else None
+      
+      if key is None or key[1] not in ivs or key in self.iv_ptrs:
+        continue
+      
+      slot = self.alloc_extra(type_int)
+      size = type_sizeof(node.var_type)
+      
       self.gen_expr(node.pos)
-      self.emit(f'push {type_sizeof(node.var_type)}')
-      self.emit(f'mul')
-      self.gen_expr(node.base)
-      self.emit(f'add')
-      self.ax -= 1
-    elif isinstance(node, AstUnaryOp) and node.op == '*':
-      self.gen_expr(node.body)
-    elif isinstance(node, AstAccess):
-      if node.direct:
-        self.gen_lvalue(node.base)
-        struct_type = node.base.var_type.struct_type
-      else:
-        self.gen_expr(node.base)
-        struct_type = node.base.var_type.base.struct_type
+      self.emit(op_push, size)
+      self.emit(op_mul)
+      self.gen_index_base(node.base)
+      self.emit(op_add)
+      self.gen_slot(slot)
+      self.emit(op_store, 4)
+      self.ax -= 2
       
-      member = struct_type.scope.find(node.name.text)
+      self.iv_ptrs[key] = (slot, size)
+    
+    return outer
+  
+  # keep the loop pointers indexed by a stepped variable in line with it
+  def gen_iv_step(self, node):
+    lhs = strip_brackets(node.lhs)
+    step = step_value(node)
+    
+    if not isinstance(lhs, AstIdentifier) or step is None:
+      return
+    
+    for (array, iv), (slot, size) in self.iv_ptrs.items():
+      if iv is lhs.decl:
+        self.gen_slot(slot)
+        self.emit(op_dup)
+        self.emit(op_load, 4)
+        self.emit(op_push, step * size)
+        self.emit(op_add)
+        self.emit(op_swap)
+        self.emit(op_store, 4)
+  
+  def gen_slot(self, loc):
+    self.emit(op_push, loc)
+    self.emit(op_rx, reg_fp)
+    self.emit(op_add)
+  
+  def gen_lvalue_index(self, node):
+    if self.index_key(node) in self.iv_ptrs:
+      slot, size = self.iv_ptrs[self.index_key(node)]
+      self.gen_slot(slot)
+      self.emit(op_load, 4)
+      self.ax += 1
+      return
+    
+    if isinstance(node.pos, AstConstant):
+      self.gen_index_base(node.base)
       
-      self.emit(f'push {member.loc}')
-      self.emit(f'add')
+      if node.pos.value != 0:
+        self.emit(op_push, node.pos.value * type_sizeof(node.var_type))
+        self.emit(op_add)
       
-      self.ax -= 1
-    else:
+      return
+    
+    self.gen_expr(node.pos)
+    self.emit(op_push, type_sizeof(node.var_type))
+    self.emit(op_mul)
+    self.gen_index_base(node.base)
+    self.emit(op_add)
+    self.ax -= 1
+  
+  def gen_lvalue_deref(self, node):
+    if node.op != '*':
       raise Exception("gen error: not lvalue")
-
-  def gen_expr(self, node):
-    if isinstance(node, AstExpr):
-      self.gen_expr(node.body)
-    elif isinstance(node, AstBinop):
-      self.gen_binop(node)
-    elif isinstance(node, AstUnaryOp):
-      self.gen_unary_op(node)
-    elif isinstance(node, AstConstant):
-      self.gen_constant(node)
-    elif isinstance(node, AstCall):
-      self.gen_call(node)
-    elif isinstance(node, AstIdentifier) or isinstance(node, AstIndex) or isinstance(node, AstAccess):
-      self.gen_value(node)
+    
+    self.gen_expr(node.body)
+  
+  def gen_lvalue_access(self, node):
+    if node.direct:
+      self.gen_lvalue(node.base)
     else:
-      raise Exception("IDK THIS")
-
+      self.gen_expr(node.base)
+    
+    if node.member.loc != 0:
+      self.emit(op_push, node.member.loc)
+      self.emit(op_add)
+    
+    self.ax -= 1
+  
+  def gen_expr(self, node):
+    self.expr_rule[type(node)](node)
+  
+  def gen_bracket(self, node):
+    self.gen_expr(node.body)
+  
   def gen_value(self, node):
     type_size = type_sizeof(node.var_type)
     
     self.gen_lvalue(node)
-    self.emit(f'load {type_size}')
+    self.emit(op_load, type_size)
     
     self.ax += type_size // 4
     self.ax -= 1
-
+  
   def gen_unary_op(self, node):
     if node.op == '-':
       self.gen_expr(node.body)
-      self.emit("push -1")
-      self.emit("mul")
-    if node.op == '&':
+      self.emit(op_push, -1)
+      self.emit(op_mul)
+    elif node.op == '&':
       self.gen_lvalue(node.body)
     elif node.op == '*':
-      self.gen_lvalue(node)
-      self.emit('load')
+      self.gen_value(node)
     else:
       raise Exception("IDK THIS")
-
+  
   def gen_call(self, node):
-    if isinstance(node.base, AstIdentifier):
-      fn = self.scope.find(node.base.name)
-    
-    if not fn:
-      raise Excpetion("CANT FIND FUNCTION!!!!")
+    fn = node.base.decl
     
     arg_size = 0
     
@@ -244,55 +410,46 @@ class CodeGen:
       arg_size += type_sizeof(arg.var_type)
     
     if arg_size > 0:
-      self.emit(f'arg {arg_size}')
+      self.emit(op_arg, arg_size)
     
     self.ax -= arg_size // 4
     
-    self.emit(f"call {fn.label}")
+    self.emit(op_call, fn.label)
     
     if fn.var_type:
       type_size = type_sizeof(fn.var_type)
-      self.emit(f"param {type_size}")
+      self.emit(op_param, type_size)
       self.ax += type_size // 4
-
+  
   def gen_constant(self, node):
-    self.emit(f'push {node.value}')
+    self.emit(op_push, node.value)
     self.ax += 1
   
-  def gen_cmp_cond(self, node, lbl_end, lbl_else=None):
-    if not lbl_else:
-      lbl_else = lbl_end
-    
-    self.gen_expr(node.lhs)
-    self.gen_expr(node.rhs)
-    
-    if node.op == ">":
-      self.emit(f'jle {lbl_else}')
-    elif node.op == ">=":
-      self.emit(f'jlt {lbl_else}')
-    elif node.op == "<":
-      self.emit(f'jge {lbl_else}')
-    elif node.op == "<=":
-      self.emit(f'jgt {lbl_else}')
+  # jump to lbl_end when the condition is false. anything but a comparison
+  # is tested against zero.
+  def gen_cmp_cond(self, node, lbl_end):
+    if isinstance(node, AstExpr):
+      node = node.body
     
-    self.ax -= 2
+    if isinstance(node, AstBinop) and node.op in false_branch:
+      self.gen_expr(node.lhs)
+      self.gen_expr(node.rhs)
+      self.emit(false_branch[node.op], lbl_end)
+      self.ax -= 2
+    else:
+      self.gen_expr(node)
+      self.emit(op_jz, lbl_end)
+      self.ax -= 1
   
   def gen_binop(self, node):
-    if (
-      var_type_cmp(node.lhs.var_type, TypeSpecifier("int")) and
-      var_type_cmp(node.rhs.var_type, TypeSpecifier("int")) or
-      (
-        isinstance(node.lhs.var_type, TypePointer) and
-        isinstance(node.rhs.var_type, TypePointer) and
-        var_type_cmp(node.lhs.var_type.base, node.rhs.var_type.base)
-      )
-    ):
+    lhs_type = node.lhs.var_type
+    
+    if lhs_type is not node.rhs.var_type:
+      raise Exception("IDK!!!")
+    
+    if lhs_type is type_int or isinstance(lhs_type, TypePointer):
       self.gen_binop_int_int(node)
-    elif (
-      isinstance(node.lhs.var_type, TypeSpecifier) and
-      isinstance(node.rhs.var_type, TypeSpecifier) and
-      node.lhs.var_type.struct_type.name == node.rhs.var_type.struct_type.name
-    ):
+    elif isinstance(lhs_type, TypeSpecifier):
       self.gen_binop_struct_struct(node)
     else:
       raise Exception("IDK!!!")
@@ -304,7 +461,7 @@ class CodeGen:
       self.gen_expr(node.rhs)
       self.gen_lvalue(node.lhs)
       
-      self.emit(f'store {type_size}')
+      self.emit(op_store, type_size)
       
       self.ax -= type_size // 4
       self.ax -= 1
@@ -315,32 +472,28 @@ class CodeGen:
     if node.op == "=":
       self.gen_expr(node.rhs)
       self.gen_lvalue(node.lhs)
-      self.emit('store 4')
+      self.emit(op_store, 4)
+      self.ax -= 2
+    elif node.op in assign_ops:
+      # the target address is computed once: dup keeps it for the store
+      self.gen_lvalue(node.lhs)
+      self.emit(op_dup)
+      self.emit(op_load, 4)
+      self.gen_expr(node.rhs)
+      self.emit(arith_ops[node.op[:-1]])
+      self.emit(op_swap)
+      self.emit(op_store, 4)
       self.ax -= 2
-    elif node.op == ">" or node.op == "<" or node.op == ">=" or node.op == "<=":
-      lbl_end = self.label()
-      lbl_else = self.label()
-      
-      self.gen_cmp_cond(node, lbl_else, lbl_end)
-      self.emit("push 1")
-      self.emit(f'jmp {lbl_end}')
-      self.emit_label(lbl_else)
-      self.emit("push 0")
-      self.emit_label(lbl_end)
       
-      self.ax += 1
+      self.gen_iv_step(node)
     else:
       self.gen_expr(node.lhs)
       self.gen_expr(node.rhs)
       
-      if node.op == "+":
-        self.emit("add")
-      elif node.op == "-":
-        self.emit("sub")
-      elif node.op == "*":
-        self.emit("mul")
-      elif node.op == "/":
-        self.emit("div")
+      if node.op in arith_ops:
+        self.emit(arith_ops[node.op])
+      elif node.op in cmp_ops:
+        self.emit(cmp_ops[node.op])
       else:
         raise Exception("I DONT KNOW THIS ONE!!!")
       
@@ -348,24 +501,10 @@ class CodeGen:
   
   def label(self):
     self.lbl_name += 1
-    return f'label_{self.lbl_name}'
+    return f'{self.lbl_unit}_{self.lbl_name}'
   
   def emit_label(self, label):
-    self.code.append(f'__{label}')
+    self.code.append((op_label, label))
   
-  def emit(self, text):
-    self.code.append(text)
-
-def type_sizeof(var_type):
-  if isinstance(var_type, TypeSpecifier):
-    if var_type.specifier == "int":
-      return 4
-    elif var_type.specifier == "struct":
-      return var_type.struct_type.size
-  elif isinstance(var_type, TypeArray):
-    return var_type.size * type_sizeof(var_type.base)
-  elif isinstance(var_type, TypePointer):
-    return 4
-  else:
-    print(var_type)
-    raise Exception("I DONT KNOW THIS ONE!!!")
+  def emit(self, op, operand=None):
+    self.code.append((op, operand))
@@ -1,9 +1,19 @@
-
-def find_match(matches):
-  for match in matches:
-    res = match()
+class Dispatch(dict):
+  def __init__(self, name, handlers={}):
+    super().__init__(handlers)
+    self.name = name
+  
+  def __missing__(self, node_type):
+    raise Exception(f"{self.name}: no handler for '{node_type.__name__}'")
+  
+  def register(self, *node_types):
+    def decorate(handler):
+      for node_type in node_types:
+        self[node_type] = handler
+      
+      return handler
     
-    if res:
-      return res
+    return decorate
   
-  return None
+  def __call__(self, *args):
+    return self[type(args[-1])](*args)
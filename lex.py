@@ -1,11 +1,18 @@
+import os
 import re
-from helper import find_match
+import sys
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
 
 class LexError(Exception):
   def __init__(self, token, message):
     super().__init__(f'{token.src}:{token.line}: {message}')
 
 class Token:
+  __slots__ = ("token_type", "text", "line", "src")
+  
   def __init__(self, token_type, text, line=0, src="None"):
     self.token_type = token_type
     self.text = text
@@ -15,6 +22,93 @@ class Token:
   def __repr__(self):
     return self.text
 
+keywords = { "int", "if", "while", "for", "fn", "print", "return", "struct", "import" }
+
+symbols = [
+  "+=", "-=", "*=", "/=",
+  "->", ",", ".",
+  "(", ")", "[", "]", "{", "}",
+  "=",
+  "==", "!=",
+  "<=", ">=", "<", ">",
+  "+", "-", "*", "/",
+  "&",
+  ";", ":"
+]
+
+# longest symbols first so '==' is never split into '=' '='
+symbol_pattern = '|'.join([ re.escape(x) for x in sorted(symbols, key=len, reverse=True) ])
+
+token_pattern = (
+  "(?P<Number>[0-9]+)|"
+  "(?P<Identifier>[a-zA-Z_][a-zA-Z0-9_]*)|"
+  f"(?P<Symbol>{symbol_pattern})"
+)
+
+str_pattern = (re.compile("[ \t\n]*"), re.compile(token_pattern), "\n")
+bytes_pattern = (re.compile(b"[ \t\n]*"), re.compile(token_pattern.encode()), b"\n")
+
+def scan_spans(text, pattern, pos=0, line=1):
+  whitespace, token, newline = pattern
+  
+  size = len(text)
+  
+  while True:
+    end = whitespace.match(text, pos).end()
+    line += text[pos:end].count(newline)
+    pos = end
+    
+    if pos >= size:
+      yield ("EOF", pos, pos, line)
+      return
+    
+    match = token.match(text, pos)
+    
+    if not match:
+      char = text[pos:pos+1]
+      print(f"skipping unknown character({char if isinstance(char, str) else char.decode(errors='replace')})")
+      pos += 1
+      continue
+    
+    token_type = match.lastgroup
+    
+    if token_type != "Number":
+      value = match.group()
+      
+      if not isinstance(value, str):
+        value = value.decode()
+      
+      if token_type == "Symbol" or value in keywords:
+        token_type = value
+    
+    pos = match.end()
+    
+    yield (token_type, match.start(), pos, line)
+
+def token_text(text, token_type, start, end):
+  if token_type == "EOF":
+    return "EOF"
+  
+  value = text[start:end]
+  
+  if not isinstance(value, str):
+    value = value.decode()
+  
+  return sys.intern(value)
+
+def scan(text, src, pattern):
+  for token_type, start, end, line in scan_spans(text, pattern):
+    yield Token(sys.intern(token_type), token_text(text, token_type, start, end), line, src)
+
+def scan_map(src):
+  with open(src, "rb") as file:
+    if os.fstat(file.fileno()).st_size == 0:
+      yield from scan(b"", src, bytes_pattern)
+      return
+    
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as text:
+      yield from scan(text, src, bytes_pattern)
+
 class Lex:
   def __init__(self, src):
     file = open(src)
@@ -22,33 +116,39 @@ class Lex:
     file.close()
     
     self.src = src
-    self.text = text
+    self.open(scan(text, src, str_pattern))
+  
+  def open(self, tokens):
+    self.tokens = tokens
+    self.lookahead = deque()
     self.token = None
-    self.line = 1
     self.next()
   
   def next(self):
-    self.skip_whitespace()
+    if self.lookahead:
+      self.token = self.lookahead.popleft()
+    elif not self.token or self.token.token_type != "EOF":
+      self.token = next(self.tokens)
     
-    if len(self.text) == 0:
-      self.token = Token("EOF", "EOF", self.line, self.src)
+    if self.token.token_type == "EOF":
       return None
     
-    self.token = find_match([
-      lambda : self.match_number(),
-      lambda : self.match_identifier(),
-      lambda : self.match_symbol()
-    ])
-    
-    if not self.token:
-      print(f"skipping unknown character({self.text[0]})")
-      self.text = self.text[1:]
-      return self.next()
-    
-    self.text = self.text[len(self.token.text):]
-    
     return self.token
   
+  def peek(self, n=1):
+    while len(self.lookahead) < n:
+      if self.lookahead:
+        last = self.lookahead[-1]
+      else:
+        last = self.token
+      
+      if last.token_type == "EOF":
+        return last
+      
+      self.lookahead.append(next(self.tokens))
+    
+    return self.lookahead[n - 1]
+  
   def match(self, token_type):
     if self.token == None:
       return None
@@ -77,50 +177,159 @@ class Lex:
     token = self.token
     self.next()
     return token
+
+class MapLex(Lex):
+  def __init__(self, src):
+    self.src = src
+    self.open(scan_map(src))
+
+token_types = [ "EOF", "Number", "Identifier" ] + sorted(keywords) + symbols
+token_code = { token_type: code for code, token_type in enumerate(token_types) }
+
+def common_prefix(a, b):
+  lo = 0
+  hi = min(len(a), len(b))
   
-  def skip_whitespace(self):
-    while re.search("^[ \t\n]", self.text):
-      if self.text.startswith("\n"):
-        self.line += 1
-      
-      self.text = self.text[1:]
+  while lo < hi:
+    mid = (lo + hi + 1) // 2
+    
+    if a[lo:mid] == b[lo:mid]:
+      lo = mid
+    else:
+      hi = mid - 1
+  
+  return lo
+
+def common_suffix(a, b, limit):
+  lo = 0
+  hi = limit
+  
+  while lo < hi:
+    mid = (lo + hi + 1) // 2
+    
+    if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+      lo = mid
+    else:
+      hi = mid - 1
+  
+  return lo
+
+class TokenBuffer:
+  def __init__(self, text, src, spans=None):
+    self.text = text
+    self.src = src
+    self.kind = array('B')
+    self.start = array('q')
+    self.end = array('q')
+    self.line = array('q')
+    
+    if spans is None:
+      spans = scan_spans(text, str_pattern)
+    
+    for token_type, start, end, line in spans:
+      self.kind.append(token_code[token_type])
+      self.start.append(start)
+      self.end.append(end)
+      self.line.append(line)
   
-  def match_identifier(self):
-    match = re.search("^[a-zA-Z_][a-zA-Z0-9_]*", self.text)
+  def update(self, text):
+    if text == self.text:
+      return self
+    
+    prefix = common_prefix(self.text, text)
+    suffix = common_suffix(self.text, text, min(len(self.text), len(text)) - prefix)
+    delta = len(text) - len(self.text)
+    
+    # rescan from the token before the edit, a token ending at the edit may grow into it
+    n = max(bisect_right(self.start, prefix) - 2, 0)
+    
+    buffer = TokenBuffer(text, self.src, ())
+    buffer.kind = self.kind[:n]
+    buffer.start = self.start[:n]
+    buffer.end = self.end[:n]
+    buffer.line = self.line[:n]
     
-    keyword = [ "int", "if", "while", "for", "fn", "print", "return", "struct" ]
+    pos = self.start[n] if n > 0 else 0
+    line = self.line[n] if n > 0 else 1
     
-    if match:
-      if match.group() in keyword:
-        return Token(match.group(), match.group(), self.line, self.src)
+    for token_type, start, end, line in scan_spans(text, str_pattern, pos, line):
+      code = token_code[token_type]
       
-      return Token("Identifier", match.group(), self.line, self.src)
+      # once back in the unchanged tail on an old token boundary the rest of the scan is the same
+      if start >= len(text) - suffix:
+        m = bisect_left(self.start, start - delta)
+        
+        if m < len(self.kind) and self.start[m] == start - delta and self.kind[m] == code:
+          shift = line - self.line[m]
+          buffer.kind.extend(self.kind[m:])
+          buffer.start.extend([ x + delta for x in self.start[m:] ])
+          buffer.end.extend([ x + delta for x in self.end[m:] ])
+          buffer.line.extend([ x + shift for x in self.line[m:] ])
+          return buffer
+      
+      buffer.kind.append(code)
+      buffer.start.append(start)
+      buffer.end.append(end)
+      buffer.line.append(line)
     
-    return None
+    return buffer
+  
+  def __len__(self):
+    return len(self.kind)
+  
+  def token_type(self, n):
+    return token_types[self.kind[n]]
+  
+  def text_at(self, n):
+    return token_text(self.text, self.token_type(n), self.start[n], self.end[n])
   
-  def match_symbol(self):
-    symbols = [
-      "+=", "-=", "*=", "/=",
-      "->", ",", ".",
-      "(", ")", "[", "]", "{", "}",
-      "=",
-      "==", "!=",
-      "<=", ">=", "<", ">",
-      "+", "-", "*", "/",
-      "&",
-      ";", ":"
-    ]
-    
-    for symbol in symbols:
-      if self.text.startswith(symbol):
-        return Token(symbol, symbol, self.line, self.src)
+  def token(self, n):
+    return Token(self.token_type(n), self.text_at(n), self.line[n], self.src)
+
+class BufferLex(Lex):
+  def __init__(self, src, buffer=None):
+    if not buffer:
+      file = open(src)
+      buffer = TokenBuffer(file.read(), src)
+      file.close()
     
-    return None
+    self.src = src
+    self.buffer = buffer
+    self.index = 0
+    self.current = None
+  
+  @property
+  def token(self):
+    if not self.current:
+      self.current = self.buffer.token(self.index)
+    
+    return self.current
   
-  def match_number(self):
-    match = re.search("^[0-9]+", self.text)
+  def seek(self, index):
+    self.index = index
+    self.current = None
+  
+  def next(self):
+    if self.index < len(self.buffer) - 1:
+      self.index += 1
+      self.current = None
     
-    if match:
-      return Token("Number", match.group(), self.line, self.src)
+    if self.buffer.kind[self.index] == 0:
+      return None
+    
+    return self.token
+  
+  def peek(self, n=1):
+    return self.buffer.token(min(self.index + n, len(self.buffer) - 1))
+  
+  def match(self, token_type):
+    if self.buffer.kind[self.index] == token_code.get(token_type):
+      return self.token
+    
+    return None
+  
+  def accept(self, token_type):
+    if self.buffer.kind[self.index] == token_code.get(token_type):
+      return self.pop()
     
     return None
@@ -0,0 +1,655 @@
+from ast import *
+from lex import Token
+from helper import Dispatch
+
+fold_ops = {
+  "+": lambda a, b: a + b,
+  "-": lambda a, b: a - b,
+  "*": lambda a, b: a * b,
+  "/": lambda a, b: a // b,
+  ">": lambda a, b: int(a > b),
+  ">=": lambda a, b: int(a >= b),
+  "<": lambda a, b: int(a < b),
+  "<=": lambda a, b: int(a <= b),
+  "==": lambda a, b: int(a == b),
+  "!=": lambda a, b: int(a != b)
+}
+
+inline_limit = 40
+
+def optimize_pass(node, entry=True):
+  Inline(node.body)
+  
+  for fn in node.body.scope.var.values():
+    if isinstance(fn, AstFunc) and fn.body:
+      optimize_func(fn)
+  
+  optimize_body(node.body)
+  
+  if entry:
+    prune_functions(node.body)
+  
+  return node
+
+def optimize_func(fn):
+  ConstantFold(fn.body, fn.params)
+  DeadCode(fn.body, fn.params)
+  return fn
+
+def optimize_body(node):
+  ConstantFold(node)
+  DeadCode(node, extern=[ fn.body for fn in node.scope.var.values() if isinstance(fn, AstFunc) and fn.body ])
+  return node
+
+# only functions reachable through calls from the main body are kept. a module
+# imported by others is not an entry, since any of its functions may be called.
+def prune_functions(node):
+  reachable = set()
+  work = [node]
+  
+  while work:
+    for child in ast_walk(work.pop()):
+      if isinstance(child, AstCall) and child.base.decl not in reachable:
+        reachable.add(child.base.decl)
+        
+        if child.base.decl.body:
+          work.append(child.base.decl.body)
+  
+  for name, var in list(node.scope.var.items()):
+    if isinstance(var, AstFunc) and var not in reachable:
+      del node.scope.var[name]
+
+def frame_alloc(scope):
+  scope.size = 0
+  scope_alloc(scope)
+
+def scope_alloc(scope):
+  for var in scope.var.values():
+    if isinstance(var, AstVar):
+      var.loc = scope.alloc(var.var_type)
+  
+  for child in scope.child:
+    scope_alloc(child)
+
+def scope_vars(scope):
+  for name, var in scope.var.items():
+    if isinstance(var, AstVar):
+      yield scope, name, var
+  
+  for child in scope.child:
+    yield from scope_vars(child)
+
+def cond_value(node):
+  if isinstance(node, AstConstant):
+    return node.value
+  
+  if (
+    isinstance(node, AstBinop) and
+    isinstance(node.lhs, AstConstant) and
+    isinstance(node.rhs, AstConstant) and
+    node.op in fold_ops
+  ):
+    return fold_ops[node.op](node.lhs.value, node.rhs.value)
+  
+  return None
+
+def store_var(stmt):
+  if isinstance(stmt, AstStmt) and isinstance(stmt.body.body, AstBinop):
+    node = stmt.body.body
+    
+    if node.op == '=' and isinstance(node.lhs, AstIdentifier):
+      return node.lhs.decl
+  
+  return None
+
+def pure_expr(node):
+  for child in ast_walk(node):
+    if isinstance(child, AstCall) or (isinstance(child, AstBinop) and child.op in assign_ops):
+      return False
+  
+  return True
+
+def simple_expr(node):
+  if isinstance(node, AstUnaryOp) and node.op == '&':
+    node = node.body
+  
+  return isinstance(node, (AstConstant, AstIdentifier))
+
+# whether a function takes the address of something in its own frame. a
+# call that reuses the frame would leave that address dangling.
+def frame_escapes(fn):
+  local = { var for scope, name, var in scope_vars(fn.body.scope) }
+  
+  for node in ast_walk(fn.body):
+    if isinstance(node, AstUnaryOp) and node.op == '&':
+      root = node.body
+      
+      while True:
+        if isinstance(root, AstExpr):
+          root = root.body
+        elif isinstance(root, AstAccess) and root.direct:
+          root = root.base
+        elif isinstance(root, AstIndex) and isinstance(root.base.var_type, TypeArray):
+          root = root.base
+        else:
+          break
+      
+      if isinstance(root, AstIdentifier) and root.decl in local:
+        return True
+  
+  return False
+
+def strip_brackets(node):
+  while isinstance(node, AstExpr):
+    node = node.body
+  
+  return node
+
+# the constant an assignment steps its target by, or None for any other
+# assignment
+def step_value(node):
+  rhs = strip_brackets(node.rhs)
+  
+  if node.op not in ("+=", "-=") or not isinstance(rhs, AstConstant):
+    return None
+  
+  return rhs.value if node.op == "+=" else -rhs.value
+
+# int variables the loop code in nodes only ever steps by a constant
+def loop_ivs(nodes):
+  steps = {}
+  
+  for node in nodes:
+    if isinstance(node, AstBinop) and node.op in assign_ops:
+      lhs = strip_brackets(node.lhs)
+      
+      if isinstance(lhs, AstIdentifier):
+        steps[lhs.decl] = steps.get(lhs.decl, True) and step_value(node) is not None
+  
+  return { var for var, stepped in steps.items() if stepped and var.var_type is type_int }
+
+def fold_constant(value, node):
+  line, src = ast_src(node)
+  return AstConstant(value, Token("Number", str(value), line, src), var_type=type_int)
+
+class Inline:
+  def __init__(self, node):
+    self.fns = [ fn for fn in node.scope.var.values() if isinstance(fn, AstFunc) and fn.body ]
+    self.calls = { fn: set(self.callees(fn.body)) for fn in self.fns }
+    self.recursive = { fn for fn in self.fns if self.reaches(fn, fn) }
+    self.size = {}
+    self.fn = None
+    self.count = 0
+    
+    self.stmt_rule = Dispatch("inline_stmt", {
+      AstPrintStmt: self.inline_print_stmt,
+      AstReturnStmt: self.inline_print_stmt,
+      AstIfStmt: self.inline_if_stmt,
+      AstWhileStmt: self.inline_if_stmt,
+      AstForStmt: self.inline_for_stmt,
+      AstStmt: self.inline_print_stmt
+    })
+    
+    # callees are finished before their callers so that a caller takes in
+    # bodies that are already inlined themselves
+    for fn in self.fns:
+      self.visit(fn)
+    
+    self.fn = None
+    self.inline_body(node)
+  
+  def callees(self, node):
+    for child in ast_walk(node):
+      if isinstance(child, AstCall) and child.base.decl.body:
+        yield child.base.decl
+  
+  def reaches(self, fn, target):
+    seen = set()
+    work = list(self.calls[fn])
+    
+    while work:
+      callee = work.pop()
+      
+      if callee is target:
+        return True
+      
+      if callee not in seen:
+        seen.add(callee)
+        work.extend(self.calls.get(callee, ()))
+    
+    return False
+  
+  def visit(self, fn):
+    if fn in self.size:
+      return
+    
+    self.size[fn] = None
+    
+    for callee in self.calls[fn]:
+      if callee in self.calls:
+        self.visit(callee)
+    
+    self.fn = fn
+    self.inline_body(fn.body)
+    self.size[fn] = sum(1 for _ in ast_walk(fn.body))
+  
+  def inlinable(self, fn):
+    return (
+      fn.body is not None and
+      fn is not self.fn and
+      fn not in self.recursive and
+      self.size.get(fn) is not None and
+      self.size[fn] <= inline_limit
+    )
+  
+  def inline_body(self, node):
+    body = []
+    
+    for stmt in node.body:
+      body += self.inline_stmt(node.scope, stmt)
+    
+    node.body = body
+  
+  def inline_stmt(self, scope, node):
+    self.stmt_rule[type(node)](node)
+    return self.expand(scope, node)
+  
+  def inline_print_stmt(self, node):
+    if node.body:
+      node.body = self.inline_expr(node.body)
+  
+  def inline_if_stmt(self, node):
+    node.cond = self.inline_expr(node.cond)
+    self.inline_body(node.body)
+  
+  def inline_for_stmt(self, node):
+    init = []
+    
+    for stmt in node.init:
+      init += self.inline_stmt(node.body.scope, stmt)
+    
+    node.init = init
+    node.cond = self.inline_expr(node.cond)
+    self.inline_body(node.body)
+    node.step = self.inline_expr(node.step)
+  
+  def inline_expr(self, node):
+    for field, encoding in ast_fields[type(node)]:
+      if encoding == "node" and getattr(node, field) is not None:
+        setattr(node, field, self.inline_expr(getattr(node, field)))
+      elif encoding == "list":
+        setattr(node, field, [ self.inline_expr(x) for x in getattr(node, field) ])
+    
+    if isinstance(node, AstCall):
+      return self.substitute(node) or node
+    
+    return node
+  
+  # a body that is a single 'return expr;' replaces the call with expr, with
+  # the arguments put in place of the parameters
+  def substitute(self, node):
+    fn = node.base.decl
+    
+    if not self.inlinable(fn):
+      return None
+    
+    body = fn.body.body
+    
+    if len(body) != 1 or not isinstance(body[0], AstReturnStmt) or not body[0].body:
+      return None
+    
+    expr = body[0].body
+    uses = {}
+    
+    for child in ast_walk(expr):
+      if isinstance(child, AstIdentifier):
+        uses[child.decl] = uses.get(child.decl, 0) + 1
+      elif isinstance(child, AstBinop) and child.op in assign_ops:
+        return None
+      elif isinstance(child, AstUnaryOp) and child.op == '&' and isinstance(child.body, AstIdentifier):
+        return None
+    
+    for param, arg in zip(fn.params, node.args):
+      if not pure_expr(arg) or (uses.get(param, 0) > 1 and not simple_expr(arg)):
+        return None
+    
+    return ast_clone(expr, dict(zip(fn.params, node.args)))
+  
+  def call_site(self, node):
+    if isinstance(node, AstPrintStmt) and isinstance(node.body, AstCall):
+      return node.body
+    
+    if isinstance(node, AstStmt):
+      expr = node.body.body
+      
+      if isinstance(expr, AstCall):
+        return expr
+      
+      if isinstance(expr, AstBinop) and expr.op == '=' and isinstance(expr.lhs, AstIdentifier) and isinstance(expr.rhs, AstCall):
+        return expr.rhs
+    
+    return None
+  
+  def sink(self, node, call, expr):
+    if isinstance(node, AstPrintStmt):
+      node.body = expr
+    elif node.body.body is call:
+      node = AstStmt(AstExpr(expr))
+    else:
+      node.body.body.rhs = expr
+    
+    return node
+  
+  # a call that makes up a whole statement takes in any small body. the
+  # parameters and locals of the callee get slots in the caller's frame and
+  # the final return feeds the statement.
+  def expand(self, scope, node):
+    call = self.call_site(node)
+    
+    if not call or not self.inlinable(call.base.decl):
+      return [node]
+    
+    fn = call.base.decl
+    body = fn.body.body
+    whole = isinstance(node, AstStmt) and node.body.body is call
+    final = body[-1] if body and isinstance(body[-1], AstReturnStmt) else None
+    returns = sum(1 for child in ast_walk(fn.body) if isinstance(child, AstReturnStmt))
+    
+    if final:
+      returns -= 1
+    
+    if returns > 0 or not (whole or (final and final.body)):
+      return [node]
+    
+    decls = {}
+    
+    for var_scope, key, var in scope_vars(fn.body.scope):
+      self.count += 1
+      name = f'{fn.name.text}.{var.name.text}.{self.count}'
+      
+      new = AstVar(var.var_type, Token("Identifier", name, var.name.line, var.name.src), None)
+      new.loc = scope.alloc(new.var_type)
+      scope.insert(name, new)
+      
+      decls[var] = AstIdentifier(name, new.name, var_type=new.var_type, decl=new)
+    
+    stmts = []
+    
+    for param, arg in zip(fn.params, call.args):
+      stmts.append(AstStmt(AstExpr(AstBinop(ast_clone(decls[param]), '=', arg, var_type=param.var_type))))
+    
+    stmts += ast_clone(body, decls, scope)
+    
+    if final:
+      ret = stmts.pop()
+      
+      if ret.body:
+        stmts.append(self.sink(node, call, ret.body))
+    
+    return stmts
+
+class ConstantFold:
+  def __init__(self, body, params=[]):
+    self.consts = {}
+    self.stores = { param: 1 for param in params }
+    self.taken = set()
+    
+    self.stmt_rule = Dispatch("fold_stmt", {
+      AstPrintStmt: self.fold_print_stmt,
+      AstReturnStmt: self.fold_return_stmt,
+      AstIfStmt: self.fold_if_stmt,
+      AstWhileStmt: self.fold_while_stmt,
+      AstForStmt: self.fold_for_stmt,
+      AstStmt: self.fold_expr_stmt
+    })
+    
+    self.expr_rule = Dispatch("fold_expr", {
+      AstExpr: self.fold_bracket,
+      AstBinop: self.fold_binop,
+      AstUnaryOp: self.fold_unary_op,
+      AstConstant: lambda node: node,
+      AstIdentifier: self.fold_identifier,
+      AstCall: self.fold_call,
+      AstIndex: self.fold_index,
+      AstAccess: self.fold_access
+    })
+    
+    self.count_stores(body)
+    self.fold_body(body)
+  
+  def count_stores(self, body):
+    for node in ast_walk(body):
+      if isinstance(node, AstBinop) and node.op in assign_ops and isinstance(node.lhs, AstIdentifier):
+        self.stores[node.lhs.decl] = self.stores.get(node.lhs.decl, 0) + 1
+      elif isinstance(node, AstUnaryOp) and node.op == '&' and isinstance(node.body, AstIdentifier):
+        self.taken.add(node.body.decl)
+  
+  def fold_body(self, node):
+    for stmt in node.body:
+      self.stmt_rule[type(stmt)](stmt)
+      self.define(node.scope, stmt)
+  
+  # a local stored exactly once, at the top level of the block declaring it,
+  # holds that value for every read that comes after the store
+  def define(self, scope, stmt):
+    if not isinstance(stmt, AstStmt) or not isinstance(stmt.body.body, AstBinop):
+      return
+    
+    node = stmt.body.body
+    
+    if node.op != '=' or not isinstance(node.lhs, AstIdentifier) or not isinstance(node.rhs, AstConstant):
+      return
+    
+    var = node.lhs.decl
+    
+    if (
+      scope.var.get(node.lhs.name) is var and
+      var.var_type is type_int and
+      self.stores.get(var) == 1 and
+      var not in self.taken
+    ):
+      self.consts[var] = node.rhs
+  
+  def fold_expr_stmt(self, node):
+    node.body = self.fold_expr(node.body)
+  
+  def fold_print_stmt(self, node):
+    node.body = self.fold_expr(node.body)
+  
+  def fold_return_stmt(self, node):
+    if node.body:
+      node.body = self.fold_expr(node.body)
+  
+  def fold_if_stmt(self, node):
+    node.cond = self.fold_cond(node.cond)
+    self.fold_body(node.body)
+  
+  def fold_while_stmt(self, node):
+    node.cond = self.fold_cond(node.cond)
+    self.fold_body(node.body)
+  
+  def fold_for_stmt(self, node):
+    for stmt in node.init:
+      self.stmt_rule[type(stmt)](stmt)
+    
+    node.cond = self.fold_cond(node.cond)
+    self.fold_body(node.body)
+    node.step = self.fold_expr(node.step)
+  
+  # CodeGen branches on the comparison itself, so only its operands fold
+  def fold_cond(self, node):
+    if isinstance(node, AstBinop):
+      node.lhs = self.fold_expr(node.lhs)
+      node.rhs = self.fold_expr(node.rhs)
+      return node
+    
+    return self.fold_expr(node)
+  
+  def fold_expr(self, node):
+    return self.expr_rule[type(node)](node)
+  
+  def fold_lvalue(self, node):
+    if isinstance(node, AstIdentifier):
+      return node
+    
+    return self.fold_expr(node)
+  
+  def fold_bracket(self, node):
+    node.body = self.fold_expr(node.body)
+    return node
+  
+  def fold_binop(self, node):
+    if node.op in assign_ops:
+      node.lhs = self.fold_lvalue(node.lhs)
+      node.rhs = self.fold_expr(node.rhs)
+      return node
+    
+    node.lhs = self.fold_expr(node.lhs)
+    node.rhs = self.fold_expr(node.rhs)
+    
+    if (
+      isinstance(node.lhs, AstConstant) and
+      isinstance(node.rhs, AstConstant) and
+      node.op in fold_ops and
+      not (node.op == '/' and node.rhs.value == 0)
+    ):
+      return fold_constant(fold_ops[node.op](node.lhs.value, node.rhs.value), node)
+    
+    return node
+  
+  def fold_unary_op(self, node):
+    if node.op == '&':
+      node.body = self.fold_lvalue(node.body)
+      return node
+    
+    node.body = self.fold_expr(node.body)
+    
+    if node.op == '-' and isinstance(node.body, AstConstant):
+      return fold_constant(-node.body.value, node)
+    
+    return node
+  
+  def fold_identifier(self, node):
+    return self.consts.get(node.decl, node)
+  
+  def fold_call(self, node):
+    node.args = [ self.fold_expr(arg) for arg in node.args ]
+    return node
+  
+  def fold_index(self, node):
+    node.base = self.fold_lvalue(node.base)
+    node.pos = self.fold_expr(node.pos)
+    return node
+  
+  def fold_access(self, node):
+    node.base = self.fold_lvalue(node.base)
+    return node
+
+class DeadCode:
+  def __init__(self, body, params=[], extern=[]):
+    self.stmt_rule = Dispatch("dead_stmt", {
+      AstPrintStmt: lambda node: [node],
+      AstReturnStmt: lambda node: [node],
+      AstIfStmt: self.eliminate_if_stmt,
+      AstWhileStmt: self.eliminate_while_stmt,
+      AstForStmt: self.eliminate_for_stmt,
+      AstStmt: lambda node: [node]
+    })
+    
+    self.eliminate_body(body)
+    self.eliminate_locals(body, params, extern)
+  
+  def eliminate_body(self, node):
+    body = []
+    
+    for stmt in node.body:
+      body += self.stmt_rule[type(stmt)](stmt)
+      
+      if body and isinstance(body[-1], AstReturnStmt):
+        break
+    
+    node.body = body
+  
+  def eliminate_if_stmt(self, node):
+    value = cond_value(node.cond)
+    
+    if value == 0:
+      return []
+    
+    self.eliminate_body(node.body)
+    
+    if value is None:
+      return [node]
+    
+    return node.body.body
+  
+  def eliminate_while_stmt(self, node):
+    if cond_value(node.cond) == 0:
+      return []
+    
+    self.eliminate_body(node.body)
+    return [node]
+  
+  def eliminate_for_stmt(self, node):
+    if cond_value(node.cond) == 0:
+      return node.init
+    
+    self.eliminate_body(node.body)
+    return [node]
+  
+  # a local that is never read only costs its stores and its frame slot. drop
+  # both when every store is a statement of its own with no side effects.
+  def eliminate_locals(self, body, params, extern):
+    uses = {}
+    stores = {}
+    
+    for tree in [body] + extern:
+      for node in ast_walk(tree):
+        if isinstance(node, AstIdentifier):
+          uses[node.decl] = uses.get(node.decl, 0) + 1
+        elif isinstance(node, AstBinop) and node.op == '=' and isinstance(node.lhs, AstIdentifier):
+          stores[node.lhs.decl] = stores.get(node.lhs.decl, 0) + 1
+    
+    unread = set()
+    
+    for scope, name, var in scope_vars(body.scope):
+      if var not in params and uses.get(var, 0) == stores.get(var, 0):
+        unread.add(var)
+    
+    removable = {}
+    self.count_stores(body, unread, removable)
+    
+    self.dead = { var for var in unread if removable.get(var, 0) == stores.get(var, 0) }
+    
+    if not self.dead:
+      return
+    
+    self.remove_stores(body)
+    
+    for scope, name, var in list(scope_vars(body.scope)):
+      if var in self.dead:
+        del scope.var[name]
+    
+    frame_alloc(body.scope)
+  
+  def stmt_lists(self, node):
+    yield node.body
+    
+    for stmt in node.body:
+      if isinstance(stmt, AstForStmt):
+        yield stmt.init
+      
+      if isinstance(stmt, (AstIfStmt, AstWhileStmt, AstForStmt)):
+        yield from self.stmt_lists(stmt.body)
+  
+  def count_stores(self, node, unread, removable):
+    for stmts in self.stmt_lists(node):
+      for stmt in stmts:
+        var = store_var(stmt)
+        
+        if var in unread and pure_expr(stmt.body.body.rhs):
+          removable[var] = removable.get(var, 0) + 1
+  
+  def remove_stores(self, node):
+    for stmts in self.stmt_lists(node):
+      stmts[:] = [ stmt for stmt in stmts if store_var(stmt) not in self.dead ]
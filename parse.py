@@ -1,26 +1,63 @@
 from ast import *
-from helper import find_match
 from lex import LexError
 
+binop_prec = {
+  "+=": 0, "-=": 0, "*=": 0, "/=": 0, "=": 0,
+  "==": 1, "!=": 1,
+  ">=": 2, "<=": 2, "<": 2, ">": 2,
+  "+": 3, "-": 3,
+  "*": 4, "/": 4
+}
+
+binop_right = { "+=", "-=", "*=", "/=", "=" }
+
+unary_ops = { "-", "+", "&", "*" }
+
 class Parse:
   def __init__(self, lex):
     self.lex = lex
     self.struct_types = {}
+    
+    self.body_rule = {
+      "fn": self.parse_function,
+      "struct": self.parse_struct,
+      "import": self.parse_late_import
+    }
+    
+    self.stmt_rule = {
+      "print": self.parse_print_stmt,
+      "return": self.parse_return_stmt,
+      "if": self.parse_if_stmt,
+      "while": self.parse_while_stmt,
+      "for": self.parse_for_stmt
+    }
   
   def parse(self):
+    imports = self.parse_imports()
     body = self.parse_body()
     
     if not body:
-      return None
+      if not imports:
+        return None
+      
+      body = AstBody([])
     
-    return Ast(body)
+    return Ast(body, imports)
+  
+  def parse_imports(self):
+    imports = []
+    
+    while self.lex.accept("import"):
+      imports.append(self.lex.expect("Identifier"))
+      self.lex.expect(";")
+    
+    return imports
+  
+  def parse_late_import(self):
+    raise LexError(self.lex.token, "import must come before any other declaration")
   
   def parse_body(self):
-    stmt = find_match([
-      lambda : self.parse_stmt(),
-      lambda : self.parse_function(),
-      lambda : self.parse_struct()
-    ])
+    stmt = self.parse_decl()
     
     if not stmt:
       return None
@@ -29,13 +66,17 @@ class Parse:
     
     while stmt:
       body.append(stmt)
-      stmt = find_match([
-        lambda : self.parse_stmt(),
-        lambda : self.parse_function(),
-        lambda : self.parse_struct()
-      ])
+      stmt = self.parse_decl()
     
     return AstBody(body)
+  
+  def parse_decl(self):
+    rule = self.body_rule.get(self.lex.token.token_type)
+    
+    if rule:
+      return rule()
+    
+    return self.parse_stmt()
 
   def parse_struct(self):
     if not self.lex.accept("struct"):
@@ -128,21 +169,12 @@ class Parse:
     return AstVar(var_type, name, None)
 
   def parse_stmt(self):
-    body = find_match([
-      lambda : self.parse_print_stmt(),
-      lambda : self.parse_return_stmt(),
-      lambda : self.parse_if_stmt(),
-      lambda : self.parse_while_stmt(),
-      lambda : self.parse_for_stmt()
-    ])
-    
-    if body:
-      return body
+    rule = self.stmt_rule.get(self.lex.token.token_type)
+    
+    if rule:
+      return rule()
     
-    body = find_match([
-      lambda : self.parse_var(),
-      lambda : self.parse_expr()
-    ])
+    body = self.parse_var_or_expr()
     
     if not body:
       return None
@@ -156,10 +188,10 @@ class Parse:
       return None
     
     self.lex.expect("(")
-    cond = parse_expr(self.lex)
+    cond = self.parse_expr()
     self.lex.expect(")")
     
-    body = parse_compound_stmt(self.lex)
+    body = self.parse_compound_stmt()
     
     return AstIfStmt(cond, body)
 
@@ -181,19 +213,13 @@ class Parse:
     
     self.lex.expect("(")
     
-    init = find_match([
-      lambda : self.parse_expr(),
-      lambda : self.parse_var(),
-    ])
+    init = self.parse_var_or_expr()
     
     self.lex.expect(';')
     cond = self.parse_expr()
     self.lex.expect(';')
     
-    step = find_match([
-      lambda : self.parse_expr(),
-      lambda : self.parse_var(),
-    ])
+    step = self.parse_var_or_expr()
     
     self.lex.expect(")")
     
@@ -227,7 +253,7 @@ class Parse:
 
   def parse_compound_stmt(self):
     if not self.lex.match('{'):
-      return AstBody([ parse_stmt(self.lex) ])
+      return AstBody([ self.parse_stmt() ])
     
     self.lex.expect('{')
     
@@ -246,6 +272,20 @@ class Parse:
     
     return AstBody(body)
 
+  def parse_var_or_expr(self):
+    if self.match_var_type():
+      return self.parse_var()
+    
+    return self.parse_expr()
+
+  def match_var_type(self):
+    token = self.lex.token
+    
+    if token.token_type == "int":
+      return True
+    
+    return token.token_type == "Identifier" and token.text in self.struct_types
+
   def parse_var(self):
     var_type = self.parse_var_type()
     
@@ -262,83 +302,68 @@ class Parse:
     return AstVar(var_type, name, value)
 
   def parse_var_type(self):
-    specifier = find_match([
-      lambda : self.lex.accept("int")
-    ])
-    
-    var_type = None
+    if not self.match_var_type():
+      return None
     
-    if specifier:
-      var_type = TypeSpecifier(specifier.text, token=specifier)
-    elif self.lex.match("Identifier") and self.lex.token.text in self.struct_types:
-      token = self.lex.pop()
-      var_type = TypeSpecifier("struct", struct_type=self.struct_types[token.text], token=token)
+    token = self.lex.pop()
     
-    if not var_type:
-      return None
+    if token.token_type == "int":
+      var_type = type_specifier(token.text)
+    else:
+      var_type = type_specifier("struct", self.struct_types[token.text])
     
     while True:
       if self.lex.accept('['):
         size = self.lex.expect("Number")
         self.lex.expect(']')
-        var_type = TypeArray(var_type, int(size.text))
+        var_type = type_array(var_type, int(size.text))
       elif self.lex.accept('*'):
-        var_type = TypePointer(var_type)
+        var_type = type_pointer(var_type)
       else:
         break
     
     return var_type
 
   def parse_expr(self):
-    body = find_match([
-      lambda : self.parse_binop(),
-      lambda : self.parse_postfix(),
-      lambda : self.parse_primitive()
-    ])
+    body = self.parse_binop()
     
     if not body:
       return None
     
     return AstExpr(body)
 
-  def parse_binop(self):
-    return self.parse_binop_level(0)
-
-  def parse_binop_level(self, level):
-    op_set = [
-      [ "+=", "-=", "*=", "/=", "=" ],
-      [ "==", "!=" ],
-      [ ">=", "<=", "<", ">" ],
-      [ "+", "-" ],
-      [ "*", "/" ]
-    ]
-    
-    if level == len(op_set):
-      return self.parse_unary_op()
-    
-    lhs = self.parse_binop_level(level + 1)
-    
-    op = find_match([ (lambda y: (lambda : self.lex.accept(y)))(x) for x in op_set[level] ])
-    
-    if not op:
-      return lhs
+  def parse_binop(self, min_prec=0):
+    lhs = self.parse_unary_op()
     
-    rhs = self.parse_binop_level(level)
-    
-    if not rhs:
-      raise LexError(op, f"expected 'Expression' after '{op}' but found {self.lex.token.text}")
+    if not lhs:
+      return None
     
-    return AstBinop(lhs, op.text, rhs, token=op)
+    while True:
+      op = self.lex.token
+      
+      if op.token_type not in binop_prec:
+        return lhs
+      
+      prec = binop_prec[op.token_type]
+      
+      if prec < min_prec:
+        return lhs
+      
+      self.lex.pop()
+      
+      if op.token_type in binop_right:
+        rhs = self.parse_binop(prec)
+      else:
+        rhs = self.parse_binop(prec + 1)
+      
+      if not rhs:
+        raise LexError(op, f"expected 'Expression' after '{op}' but found {self.lex.token.text}")
+      
+      lhs = AstBinop(lhs, op.text, rhs, token=op)
 
   def parse_unary_op(self):
-    op = find_match([
-      lambda : self.lex.accept('-'),
-      lambda : self.lex.accept('+'),
-      lambda : self.lex.accept('&'),
-      lambda : self.lex.accept('*'),
-    ])
-    
-    if op:
+    if self.lex.token.token_type in unary_ops:
+      op = self.lex.pop()
       return AstUnaryOp(op.text, self.parse_unary_op(), token=op)
     else:
       return self.parse_postfix()
@@ -0,0 +1,447 @@
+import time
+from tac import *
+from cfg import cfg_build, cfg_lower, cfg_liveness, cfg_loops
+
+def pass_unreachable(unit):
+  if not unit.blocks:
+    return False
+  
+  blocks = unit.block_map()
+  seen = set()
+  work = [ unit.blocks[0].label ]
+  
+  while work:
+    label = work.pop()
+    
+    if label not in seen:
+      seen.add(label)
+      work += blocks[label].succ()
+  
+  keep = [ block for block in unit.blocks if block.label in seen ]
+  changed = len(keep) != len(unit.blocks)
+  unit.blocks = keep
+  
+  return changed
+
+# follow empty blocks and blocks that only jump
+def forward(blocks, label):
+  seen = set()
+  
+  while label not in seen:
+    seen.add(label)
+    block = blocks[label]
+    
+    if not block.code and block.next:
+      label = block.next
+    elif len(block.code) == 1 and block.code[0][0] == tac_jmp:
+      label = block.code[0][1]
+    else:
+      break
+  
+  return label
+
+def pass_thread(unit):
+  blocks = unit.block_map()
+  changed = False
+  
+  for block in unit.blocks:
+    term = block.term()
+    
+    if term is not None and term[0] == tac_jmp:
+      target = forward(blocks, term[1])
+      
+      if target != term[1]:
+        block.code[-1] = (tac_jmp, target, None, None)
+        changed = True
+    elif term is not None and term[0] in tac_branch:
+      target = forward(blocks, term[3])
+      
+      if target != term[3]:
+        block.code[-1] = (term[0], term[1], term[2], target)
+        changed = True
+    
+    if block.next is not None:
+      target = forward(blocks, block.next)
+      
+      if target != block.next:
+        block.next = target
+        changed = True
+  
+  return changed
+
+# append a block to its only predecessor when that predecessor always goes on
+# to it. a block that falls off the end of the unit stays last.
+def pass_merge(unit):
+  changed = False
+  n = 0
+  
+  while n < len(unit.blocks):
+    block = unit.blocks[n]
+    term = block.term()
+    succ = block.succ()
+    
+    if (
+      len(succ) == 1 and (term is None or term[0] == tac_jmp) and
+      succ[0] != block.label and succ[0] != unit.blocks[0].label
+    ):
+      target = unit.block_map()[succ[0]]
+      
+      if len(unit.preds()[target.label]) == 1 and (target.next is not None or target.ends()):
+        if term is not None:
+          block.code.pop()
+        
+        block.code += target.code
+        block.next = target.next
+        unit.blocks.remove(target)
+        changed = True
+        continue
+    
+    n += 1
+  
+  return changed
+
+# within a block, read the source of a mov instead of its copy
+def pass_copy_prop(unit):
+  changed = False
+  
+  for block in unit.blocks:
+    copies = {}
+    
+    for n, instr in enumerate(block.code):
+      new = tac_rename(instr, copies)
+      
+      if new != instr:
+        block.code[n] = new
+        changed = True
+      
+      dst = tac_def(new)
+      
+      if dst is not None:
+        copies = { r: src for r, src in copies.items() if r != dst and src != dst }
+        
+        if new[0] == tac_mov and new[2] != dst:
+          copies[dst] = new[2]
+  
+  return changed
+
+# drop instructions whose only effect is a register nobody reads. a removal
+# can leave the instructions feeding it dead, so repeat until nothing goes.
+def pass_dead_regs(unit):
+  changed = False
+  
+  while sweep_dead_regs(unit):
+    changed = True
+  
+  return changed
+
+def sweep_dead_regs(unit):
+  live_in = cfg_liveness(unit)
+  changed = False
+  
+  for block in unit.blocks:
+    live = set()
+    
+    for label in block.succ():
+      live |= live_in[label]
+    
+    code = []
+    
+    for instr in reversed(block.code):
+      dst = tac_def(instr)
+      
+      if instr[0] in tac_pure and (dst not in live or instr[0] == tac_mov and instr[1] == instr[2]):
+        changed = True
+        continue
+      
+      if dst is not None:
+        live.discard(dst)
+      
+      live.update(tac_uses(instr))
+      code.append(instr)
+    
+    code.reverse()
+    block.code = code
+  
+  return changed
+
+# pure instructions worth moving out of a loop. loads may see a store in the
+# loop and div may trap, so neither moves.
+tac_invariant = {
+  tac_neg, tac_add, tac_sub, tac_mul, tac_addi, tac_lt, tac_le, tac_gt, tac_ge, tac_eq, tac_ne, tac_lea
+}
+
+# run transform(unit, header, body) over every loop, innermost first. loops
+# are found again after each one since a transform may add a preheader.
+def each_loop(unit, transform):
+  changed = False
+  done = set()
+  
+  while True:
+    loops = cfg_loops(unit)
+    todo = [ (len(body), header) for header, body in loops.items() if header not in done ]
+    
+    if not todo:
+      return changed
+    
+    size, header = min(todo)
+    done.add(header)
+    
+    if transform(unit, header, loops[header]):
+      changed = True
+
+def loop_defs(unit, body):
+  defs = {}
+  
+  for block in unit.blocks:
+    if block.label in body:
+      for n, instr in enumerate(block.code):
+        if tac_def(instr) is not None:
+          defs.setdefault(tac_def(instr), []).append((block, n))
+  
+  return defs
+
+# within a block, an instruction computing what an earlier one already holds
+# becomes a copy of it. copies are propagated between rounds so that what
+# was computed from them matches as well.
+def pass_cse(unit):
+  changed = False
+  
+  while True:
+    pass_copy_prop(unit)
+    
+    if not sweep_cse(unit):
+      return changed
+    
+    changed = True
+
+def sweep_cse(unit):
+  changed = False
+  
+  for block in unit.blocks:
+    values = {}
+    
+    for n, (op, a, b, c) in enumerate(block.code):
+      key = (op, b, c)
+      
+      if op in tac_invariant and values.get(key, a) != a:
+        block.code[n] = (tac_mov, a, values[key], None)
+        changed = True
+      
+      if tac_def(block.code[n]) is not None:
+        values = { key: r for key, r in values.items() if a != r and a not in key[1:] }
+        
+        if op in tac_invariant and a not in (b, c):
+          values.setdefault(key, a)
+  
+  return changed
+
+# an instruction whose operands the loop never writes is computed once in the
+# preheader into a fresh register, which the loop then copies
+def hoist_invariants(unit, header, body):
+  pre = None
+  moved = True
+  changed = False
+  
+  while moved:
+    moved = False
+    defs = loop_defs(unit, body)
+    
+    for block in unit.blocks:
+      if block.label not in body:
+        continue
+      
+      for n, instr in enumerate(block.code):
+        if instr[0] in tac_invariant and not any([ r in defs for r in tac_uses(instr) ]):
+          pre = pre or unit.preheader(header, body)
+          r = unit.new_reg()
+          
+          pre.code.append((instr[0], r, instr[2], instr[3]))
+          block.code[n] = (tac_mov, instr[1], r, None)
+          moved = True
+    
+    if moved:
+      pass_copy_prop(unit)
+      changed = True
+  
+  return changed
+
+def pass_licm(unit):
+  return each_loop(unit, hoist_invariants)
+
+# registers the loop only changes by a fixed step: { r: (block, imm, reg) }
+# with the step either an immediate or an invariant register
+def induction_vars(defs):
+  ivs = {}
+  
+  for r, sites in defs.items():
+    if len(sites) != 1:
+      continue
+    
+    block, n = sites[0]
+    op, a, b, c = block.code[n]
+    
+    if op == tac_addi and b == a:
+      ivs[r] = (block, c, None)
+    elif op == tac_add and b == a and c not in defs:
+      ivs[r] = (block, None, c)
+    elif op == tac_add and c == a and b not in defs:
+      ivs[r] = (block, None, b)
+  
+  return ivs
+
+# iv * invariant, iv + invariant and iv + k inside a loop become registers of
+# their own, set up in the preheader and stepped next to the iv
+def reduce_strength(unit, header, body):
+  pre = None
+  changed = False
+  
+  while True:
+    defs = loop_defs(unit, body)
+    ivs = induction_vars(defs)
+    found = None
+    
+    for block in unit.blocks:
+      if block.label not in body or found:
+        continue
+      
+      for n, (op, a, b, c) in enumerate(block.code):
+        if a in ivs:
+          continue
+        elif op in (tac_mul, tac_add) and b in ivs and c not in defs:
+          found = (block, n, b, c)
+        elif op in (tac_mul, tac_add) and c in ivs and b not in defs:
+          found = (block, n, c, b)
+        elif op == tac_addi and b in ivs:
+          found = (block, n, b, None)
+        
+        if found:
+          break
+    
+    if not found:
+      return changed
+    
+    block, n, iv, other = found
+    op, a, b, c = block.code[n]
+    iv_block, imm, step = ivs[iv]
+    pre = pre or unit.preheader(header, body)
+    r = unit.new_reg()
+    
+    pre.code.append((op, r, b, c))
+    block.code[n] = (tac_mov, a, r, None)
+    
+    if op == tac_mul:
+      factor = unit.constant(other)
+      
+      if imm is not None and factor is not None:
+        update = (tac_addi, r, r, imm * factor)
+      else:
+        scaled = unit.new_reg()
+        
+        if imm is not None:
+          step = unit.new_reg(imm)
+        
+        pre.code.append((tac_mul, scaled, step, other))
+        update = (tac_add, r, r, scaled)
+    elif imm is not None:
+      update = (tac_addi, r, r, imm)
+    else:
+      update = (tac_add, r, r, step)
+    
+    at = iv_block.code.index(block_def(iv_block, iv)) + 1
+    iv_block.code.insert(at, update)
+    
+    pass_copy_prop(unit)
+    changed = True
+
+def block_def(block, r):
+  for instr in block.code:
+    if tac_def(instr) == r:
+      return instr
+
+# a stepped register only read by its own step is dead once the loop exits
+# without it
+def drop_dead_ivs(unit, header, body):
+  live_in = cfg_liveness(unit)
+  defs = loop_defs(unit, body)
+  changed = False
+  
+  live_out = set()
+  
+  for block in unit.blocks:
+    if block.label in body:
+      for label in block.succ():
+        if label not in body:
+          live_out |= live_in[label]
+  
+  for r, (block, imm, step) in induction_vars(defs).items():
+    uses = 0
+    
+    for other in unit.blocks:
+      if other.label in body:
+        uses += sum([ list(tac_uses(instr)).count(r) for instr in other.code ])
+    
+    if uses == 1 and r not in live_out:
+      block.code.remove(block_def(block, r))
+      changed = True
+  
+  return changed
+
+def pass_strength(unit):
+  if not each_loop(unit, reduce_strength):
+    return False
+  
+  # the copies left where the iv was used go first
+  pass_dead_regs(unit)
+  each_loop(unit, drop_dead_ivs)
+  
+  return True
+
+# (name, pass). each pass rewrites one unit and returns whether it changed it.
+cfg_passes = [
+  ("cse", pass_cse),
+  ("licm", pass_licm),
+  ("strength", pass_strength),
+  ("thread", pass_thread),
+  ("unreachable", pass_unreachable),
+  ("merge", pass_merge),
+  ("copy-prop", pass_copy_prop),
+  ("dead-regs", pass_dead_regs)
+]
+
+# builds the CFG of a TAC stream, runs the enabled passes in order over every
+# unit and lowers the result back to a flat stream
+class PassManager:
+  def __init__(self, passes=cfg_passes):
+    self.passes = list(passes)
+    self.enabled = { name: True for name, run in self.passes }
+    self.time = { name: 0.0 for name, run in self.passes }
+    self.changed = { name: 0 for name, run in self.passes }
+  
+  def disable(self, name):
+    if name not in self.enabled:
+      raise Exception(f"unknown pass '{name}'")
+    
+    self.enabled[name] = False
+  
+  def run(self, code):
+    units = cfg_build(code)
+    
+    for unit in units:
+      for name, run in self.passes:
+        if not self.enabled[name]:
+          continue
+        
+        start = time.perf_counter()
+        
+        if run(unit):
+          self.changed[name] += 1
+        
+        self.time[name] += time.perf_counter() - start
+    
+    return cfg_lower(units)
+  
+  def report(self):
+    return ", ".join([
+      f'{name} {self.time[name] * 1000:.2f}ms ({self.changed[name]} units)' if self.enabled[name] else f'{name} off'
+      for name, run in self.passes
+    ])
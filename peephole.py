@@ -0,0 +1,221 @@
+from asm import *
+
+fold_ops = {
+  op_add: lambda a, b: a + b,
+  op_sub: lambda a, b: a - b,
+  op_mul: lambda a, b: a * b,
+  op_div: lambda a, b: a // b
+}
+
+def rule_fold(window):
+  (a, x), (b, y), (op, _) = window
+  
+  if a == op_push and b == op_push and op in fold_ops and not (op == op_div and y == 0):
+    return [ (op_push, fold_ops[op](x, y)) ]
+
+def rule_identity(window):
+  (a, x), (op, _) = window
+  
+  if a == op_push and (x == 0 and op in (op_add, op_sub) or x == 1 and op in (op_mul, op_div)):
+    return []
+
+def rule_offsets(window):
+  (a, x), (op1, _), (b, y), (op2, _) = window
+  
+  if a == op_push and b == op_push and op1 == op_add and op2 == op_add:
+    return [ (op_push, x + y), (op_add, None) ]
+
+def rule_push_pop(window):
+  (a, _), (b, _) = window
+  
+  if (a == op_push or a == op_dup) and b == op_pop:
+    return []
+
+def rule_swap_swap(window):
+  if window[0][0] == op_swap and window[1][0] == op_swap:
+    return []
+
+def rule_jump_next(window):
+  (op, target), (label, name) = window
+  
+  if op == op_jmp and label == op_label and target == name:
+    return [ window[1] ]
+
+def rule_unreachable(window):
+  (op, _), (next_op, _) = window
+  
+  if op in (op_jmp, op_ret, op_tailcall) and next_op != op_label:
+    return [ window[0] ]
+
+# (name, window size, rule). a rule returns the replacement for its window,
+# or None to leave it alone. a label may only be the last entry of a window,
+# so no rule moves code across a jump target.
+peephole_rules = [
+  ("fold", 3, rule_fold),
+  ("identity", 2, rule_identity),
+  ("offsets", 4, rule_offsets),
+  ("push-pop", 2, rule_push_pop),
+  ("swap-swap", 2, rule_swap_swap),
+  ("jump-next", 2, rule_jump_next),
+  ("unreachable", 2, rule_unreachable)
+]
+
+class Peephole:
+  def __init__(self, rules=None):
+    if rules is None:
+      rules = peephole_rules + super_rules
+    
+    self.rules = rules
+    self.fired = { name: 0 for name, size, rule in rules }
+  
+  def run(self, code):
+    changed = True
+    
+    while changed:
+      code, changed = self.rewrite(code)
+    
+    return code
+  
+  def rewrite(self, code):
+    out = []
+    changed = False
+    n = 0
+    
+    while n < len(code):
+      for name, size, rule in self.rules:
+        window = code[n:n + size]
+        
+        if len(window) < size or any(op == op_label for op, _ in window[:-1]):
+          continue
+        
+        new = rule(window)
+        
+        if new is not None:
+          self.fired[name] += 1
+          out += new
+          n += size
+          changed = True
+          break
+      else:
+        out.append(code[n])
+        n += 1
+    
+    return out, changed
+  
+  def report(self):
+    return ", ".join([ f'{name} {count}' for name, count in self.fired.items() ])
+
+def rule_local(window):
+  (a, off), (rx, reg), (add, _), (op, size) = window
+  
+  if a == op_push and rx == op_rx and reg == reg_fp and add == op_add and size == 4:
+    if op == op_load:
+      return [ (op_lload, off) ]
+    elif op == op_store:
+      return [ (op_lstore, off) ]
+
+def rule_lea(window):
+  (a, off), (rx, reg), (add, _) = window
+  
+  if a == op_push and rx == op_rx and reg == reg_fp and add == op_add:
+    return [ (op_lea, off) ]
+
+def rule_immediate(window):
+  (a, n), (op, _) = window
+  
+  if a == op_push:
+    if op == op_add:
+      return [ (op_addi, n) ]
+    elif op == op_sub:
+      return [ (op_addi, -n) ]
+    elif op == op_mul:
+      return [ (op_muli, n) ]
+    elif op == op_jeq and n == 0:
+      return [ (op_jz, window[1][1]) ]
+    elif op in branch_imm:
+      return [ (branch_imm[op], (n, window[1][1])) ]
+
+def rule_member(window):
+  (a, off), (op, size) = window
+  
+  if a == op_addi and size == 4:
+    if op == op_load:
+      return [ (op_ldm, off) ]
+    elif op == op_store:
+      return [ (op_stm, off) ]
+
+# a fixed offset from a local address is another local
+def rule_lea_offset(window):
+  (lea, off), (op, n) = window
+  
+  if lea == op_lea:
+    if op == op_addi:
+      return [ (op_lea, off + n) ]
+    elif op == op_ldm:
+      return [ (op_lload, off + n) ]
+    elif op == op_stm:
+      return [ (op_lstore, off + n) ]
+
+# a word at a local address, such as a member of a struct local once its
+# offset is folded in, is a local too
+def rule_lea_word(window):
+  (lea, off), (op, size) = window
+  
+  if lea == op_lea and size == 4:
+    if op == op_load:
+      return [ (op_lload, off) ]
+    elif op == op_store:
+      return [ (op_lstore, off) ]
+
+def rule_addi_addi(window):
+  (a, x), (b, y) = window
+  
+  if a == op_addi and b == op_addi:
+    return [ (op_addi, x + y) ] if x + y != 0 else []
+
+# lea; dup; load 4; <rhs>; swap; store 4 is a compound assignment to a
+# local. rhs is a single fused op or a push and an arithmetic op. once
+# identity has dropped the push 0; add of x += 0 the rhs is empty and the
+# whole update is a no-op.
+def rule_update_local(window):
+  (lea, off), (dup, _), (load, size) = window[:3]
+  (swap, _), (store, size2) = window[-2:]
+  rhs = window[3:-2]
+  
+  if not (
+    lea == op_lea and dup == op_dup and load == op_load and size == 4 and
+    swap == op_swap and store == op_store and size2 == 4
+  ):
+    return None
+  
+  if not rhs:
+    return []
+  elif len(rhs) == 1 and rhs[0][0] in (op_addi, op_muli):
+    return [ (op_lload, off), *rhs, (op_lstore, off) ]
+  elif len(rhs) == 2 and rhs[0][0] in (op_push, op_lload) and rhs[1][0] in fold_ops:
+    return [ (op_lload, off), *rhs, (op_lstore, off) ]
+
+# adding a constant to a local
+def rule_inc_local(window):
+  (a, off), (b, n), (c, off2) = window
+  
+  if a == op_lload and b == op_addi and c == op_lstore and off == off2:
+    return [ (op_linc, (off, n)) ]
+
+branch_imm = {
+  op_jle: op_jlei, op_jge: op_jgei, op_jlt: op_jlti, op_jgt: op_jgti, op_jeq: op_jeqi, op_jne: op_jnei
+}
+
+super_rules = [
+  ("local", 4, rule_local),
+  ("lea", 3, rule_lea),
+  ("immediate", 2, rule_immediate),
+  ("member", 2, rule_member),
+  ("lea-offset", 2, rule_lea_offset),
+  ("lea-word", 2, rule_lea_word),
+  ("addi-addi", 2, rule_addi_addi),
+  ("update-local", 5, rule_update_local),
+  ("update-local", 6, rule_update_local),
+  ("update-local", 7, rule_update_local),
+  ("inc-local", 3, rule_inc_local)
+]
@@ -1,8 +1,12 @@
 from ast import *
 from lex import Token
+from helper import Dispatch
 
 def semantic_pass(node):
-  return Ast(ast_body(node.body))
+  if not node.body.scope:
+    node.body.scope = Scope(None)
+  
+  return Ast(ast_body(node.body), node.imports)
 
 def ast_body(node):
   body = []
@@ -15,34 +19,25 @@ def ast_body(node):
   return node
 
 def ast_stmt(scope, node):
-  if isinstance(node, AstPrintStmt):
-    return [ast_print_stmt(scope, node)]
-  if isinstance(node, AstReturnStmt):
-    return [ast_return_stmt(scope, node)]
-  elif isinstance(node, AstIfStmt):
-    return [ast_if_stmt(scope, node)]
-  elif isinstance(node, AstWhileStmt):
-    return [ast_while_stmt(scope, node)]
-  elif isinstance(node, AstForStmt):
-    return [ast_for_stmt(scope, node)]
-  elif isinstance(node, AstFunc):
-    return ast_func(scope, node)
-  elif isinstance(node, AstStruct):
-    return ast_struct(scope, node)
-  elif isinstance(node, AstStmt):
-    if isinstance(node.body, AstVar):
-      return ast_var(scope, node.body)
-    elif isinstance(node.body, AstExpr):
-      return [AstStmt(AstExpr(ast_expr(scope, node.body)))]
+  return ast_stmt_rule[type(node)](scope, node)
+
+def ast_expr(scope, node):
+  return ast_expr_rule[type(node)](scope, node)
+
+def ast_expr_stmt(scope, node):
+  if isinstance(node.body, AstVar):
+    return ast_var(scope, node.body)
   else:
-    raise Exception("NOT DONE BAKA!!!")
+    return [AstStmt(AstExpr(ast_expr(scope, node.body)))]
 
 def ast_struct(scope, node):
   node.scope = Scope(None)
   
   for member in node.members:
     node.scope.insert(member.name.text, member)
+    member.loc = node.scope.alloc(member.var_type)
   
+  node.size = node.scope.size
   scope.struct_type[node.name.text] = node
   
   return []
@@ -57,9 +52,10 @@ def ast_func(scope, node):
   
   for param in node.params:
     if isinstance(param.var_type, TypeArray):
-      param.var_type = TypePointer(param.var_type.base)
+      param.var_type = type_pointer(param.var_type.base)
     
     new_scope.insert(param.name.text, param)
+    param.loc = new_scope.alloc(param.var_type)
   
   node.body = ast_compound_stmt(new_scope, node.body)
   
@@ -120,6 +116,7 @@ def ast_var(scope, node):
     raise SemanticError(node, f"name '{node.name.text}' has already been declared")
   
   scope.insert(node.name.text, node)
+  node.loc = scope.alloc(node.var_type)
   
   if node.value:
     lhs = AstIdentifier(node.name.text, node.name)
@@ -131,25 +128,8 @@ def ast_var(scope, node):
   
   return []
 
-def ast_expr(scope, expr):
-  if isinstance(expr, AstExpr):
-    return ast_expr(scope, expr.body)
-  elif isinstance(expr, AstBinop):
-    return ast_binop(scope, expr)
-  elif isinstance(expr, AstUnaryOp):
-    return ast_unary_op(scope, expr)
-  elif isinstance(expr, AstConstant):
-    return ast_constant(scope, expr)
-  elif isinstance(expr, AstIdentifier):
-    return ast_identifier(scope, expr)
-  elif isinstance(expr, AstCall):
-    return ast_call(scope, expr)
-  elif isinstance(expr, AstIndex):
-    return ast_index(scope, expr)
-  elif isinstance(expr, AstAccess):
-    return ast_access(scope, expr)
-  else:
-    raise Exception(f"NOT DONE BAKA!!!")
+def ast_bracket(scope, node):
+  return ast_expr(scope, node.body)
 
 def ast_access(scope, node):
   node.base = ast_expr(scope, node.base)
@@ -174,8 +154,10 @@ def ast_access(scope, node):
   if not member:
     raise SemanticError(node, f"'{node.base.var_type}' has no attribute '{node.name.text}'")
   
+  node.member = member
+  
   if isinstance(member.var_type, TypeArray):
-    node = AstUnaryOp('&', node, var_type=TypePointer(member.var_type.base))
+    node = AstUnaryOp('&', node, var_type=type_pointer(member.var_type.base))
   else:
     node.var_type = member.var_type
   
@@ -185,7 +167,7 @@ def ast_call(scope, node):
   node.base = ast_expr(scope, node.base)
   
   if isinstance(node.base, AstIdentifier):
-    fn = scope.find(node.base.name)
+    fn = node.base.decl
   else:
     raise SemanticError(node, f"cannot call non-function '{node.base}'")
   
@@ -229,7 +211,7 @@ def ast_unary_op(scope, node):
   if node.op == "+":
     return ast_expr(scope, node.body)
   elif node.op == "&":
-    node.var_type = TypePointer(node.body.var_type)
+    node.var_type = type_pointer(node.body.var_type)
   elif node.op == "*":
     if not isinstance(node.body.var_type, TypePointer):
       raise SemanticError(node, f"invalid type argument of unary '*' (have '{node.body.var_type}')")
@@ -241,7 +223,7 @@ def ast_unary_op(scope, node):
   return node
 
 def ast_constant(scope, node):
-  node.var_type = TypeSpecifier("int")
+  node.var_type = type_int
   return node
 
 def ast_identifier(scope, node):
@@ -251,57 +233,52 @@ def ast_identifier(scope, node):
     raise SemanticError(node, f"name '{node.name}' is not defined")
   
   node.var_type = var.var_type
+  node.decl = var
   
   return node
 
 def ast_binop(scope, node):
-  if node.op in [ "+=", "-=", "*=", "/=" ]:
-    op = node.op.split("=")[0]
-    return ast_binop(scope, AstBinop(node.lhs, '=', AstBinop(node.lhs, op, node.rhs))) 
-  
   node.lhs = ast_expr(scope, node.lhs)
   node.rhs = ast_expr(scope, node.rhs)
   
-  if (
-    var_type_cmp(node.lhs.var_type, TypeSpecifier("int")) and
-    var_type_cmp(node.rhs.var_type, TypeSpecifier("int"))
-  ):
-    node.var_type = TypeSpecifier("int")
-  elif (
-    isinstance(node.lhs.var_type, TypePointer) and
-    isinstance(node.rhs.var_type, TypePointer) and
-    var_type_cmp(node.lhs.var_type.base, node.rhs.var_type.base)
-  ):
-    node.var_type = node.lhs.var_type
-  elif (
-    isinstance(node.lhs.var_type, TypeSpecifier) and
-    isinstance(node.rhs.var_type, TypeSpecifier) and
-    node.lhs.var_type.specifier == "struct" and node.rhs.var_type.specifier == "struct" and
-    node.lhs.var_type.struct_type.name == node.rhs.var_type.struct_type.name
-  ):
-    node.var_type = node.lhs.var_type
+  lhs_type = node.lhs.var_type
+  rhs_type = node.rhs.var_type
+  
+  if lhs_type is type_int and rhs_type is type_int:
+    node.var_type = type_int
+  elif lhs_type is rhs_type and isinstance(lhs_type, TypePointer):
+    node.var_type = lhs_type
+  elif lhs_type is rhs_type and isinstance(lhs_type, TypeSpecifier) and (node.op == '=' or node.op not in assign_ops):
+    node.var_type = lhs_type
   else:
-    raise SemanticError(node, f"unsupported operand type(s) for '{node.op}': '{node.lhs.var_type}' and '{node.rhs.var_type}'")
+    raise SemanticError(node, f"unsupported operand type(s) for '{node.op}': '{lhs_type}' and '{rhs_type}'")
   
   return node 
 
 def var_type_cmp(a, b):
-  if type(a) != type(b):
-    return False
-  elif isinstance(a, TypeSpecifier):
-    if a.specifier == b.specifier:
-      if a.specifier == "struct":
-        return a.struct_type.name.text == b.struct_type.name.text
-      return True
-    else:
-      return False
-  elif isinstance(a, TypeArray):
-    return var_type_cmp(a.base, b.base) and a.size == b.size
-  elif isinstance(a, TypePointer) and isinstance(b, TypePointer):
-    return var_type_cmp(a.base, b.base)
-  else:
-    print(type(a), type(b))
-    raise Exception("I DONT KNOW THIS ONE!!!")
+  return a is b
+
+ast_stmt_rule = Dispatch("ast_stmt", {
+  AstPrintStmt: lambda scope, node: [ast_print_stmt(scope, node)],
+  AstReturnStmt: lambda scope, node: [ast_return_stmt(scope, node)],
+  AstIfStmt: lambda scope, node: [ast_if_stmt(scope, node)],
+  AstWhileStmt: lambda scope, node: [ast_while_stmt(scope, node)],
+  AstForStmt: lambda scope, node: [ast_for_stmt(scope, node)],
+  AstFunc: ast_func,
+  AstStruct: ast_struct,
+  AstStmt: ast_expr_stmt
+})
+
+ast_expr_rule = Dispatch("ast_expr", {
+  AstExpr: ast_bracket,
+  AstBinop: ast_binop,
+  AstUnaryOp: ast_unary_op,
+  AstConstant: ast_constant,
+  AstIdentifier: ast_identifier,
+  AstCall: ast_call,
+  AstIndex: ast_index,
+  AstAccess: ast_access
+})
 
 class SemanticError(Exception):
   def __init__(self, node, message):
@@ -0,0 +1,159 @@
+import marshal
+import hashlib
+from ast import *
+from lex import Token
+from asm import op_names
+
+serial_magic = b'9CAST'
+serial_version = 2
+
+serial_classes = [
+  Scope, TypeSpecifier, TypePointer, TypeArray,
+  AstConstant, AstIdentifier, AstIndex, AstAccess, AstCall, AstUnaryOp, AstBinop, AstExpr,
+  AstVar, AstStruct, AstFunc,
+  AstPrintStmt, AstReturnStmt, AstIfStmt, AstWhileStmt, AstForStmt, AstStmt, AstBody, Ast,
+  Token
+]
+
+serial_types = { TypeSpecifier, TypePointer, TypeArray }
+serial_code = { cls: code for code, cls in enumerate(serial_classes) }
+serial_slots = [ cls.__slots__ for cls in serial_classes ]
+
+# any change to the node layout, or to the opcodes of the cached code, changes
+# the schema and invalidates old files
+serial_schema = hashlib.sha1(repr([
+  [ (cls.__name__, cls.__slots__) for cls in serial_classes ], op_names
+]).encode()).digest()[:8]
+serial_header = serial_magic + serial_version.to_bytes(2, 'little') + serial_schema
+
+class SerialError(Exception):
+  pass
+
+def encode_graph(node):
+  objects = []
+  index = {}
+  
+  def encode(value):
+    if value is None or isinstance(value, (bool, int, str)):
+      return value
+    elif isinstance(value, list):
+      return [ encode(x) for x in value ]
+    elif isinstance(value, dict):
+      return { k: encode(v) for k, v in value.items() }
+    
+    if id(value) not in index:
+      index[id(value)] = len(objects)
+      objects.append(value)
+    
+    return (index[id(value)],)
+  
+  root = encode(node)
+  records = []
+  
+  n = 0
+  
+  while n < len(objects):
+    obj = objects[n]
+    cls = type(obj)
+    records.append((serial_code[cls], [ encode(getattr(obj, slot)) for slot in cls.__slots__ ]))
+    n += 1
+  
+  return marshal.dumps((root, records))
+
+def decode_graph(data):
+  root, records = marshal.loads(data)
+  
+  objects = [ serial_classes[code].__new__(serial_classes[code]) for code, fields in records ]
+  
+  def decode(value):
+    kind = type(value)
+    
+    if kind is tuple:
+      return objects[value[0]]
+    elif kind is list:
+      return [ objects[x[0]] if type(x) is tuple else decode(x) for x in value ]
+    elif kind is dict:
+      return { k: decode(v) for k, v in value.items() }
+    
+    return value
+  
+  def fill(n):
+    obj = objects[n]
+    code, fields = records[n]
+    
+    for slot, value in zip(serial_slots[code], fields):
+      kind = type(value)
+      
+      if kind is tuple:
+        value = objects[value[0]]
+      elif kind is list or kind is dict:
+        value = decode(value)
+      
+      setattr(obj, slot, value)
+  
+  # types are filled and interned first so every other record links to the
+  # canonical type objects
+  types = [ n for n, (code, fields) in enumerate(records) if serial_classes[code] in serial_types ]
+  
+  for n in types:
+    fill(n)
+  
+  for n in types:
+    objects[n] = type_intern(objects[n])
+  
+  for n in range(len(records)):
+    if serial_classes[records[n][0]] not in serial_types:
+      fill(n)
+  
+  return decode(root)
+
+def read_header(data, key):
+  if not data.startswith(serial_header):
+    raise SerialError("not a compiled AST or written by a different version")
+  
+  try:
+    payload = marshal.loads(data[len(serial_header):])
+  except (EOFError, ValueError, TypeError):
+    raise SerialError("compiled AST is corrupt")
+  
+  if key is not None and key != payload[0]:
+    raise SerialError("compiled AST is out of date")
+  
+  return payload
+
+def ast_dumps(node, key=""):
+  return serial_header + marshal.dumps((key, encode_graph(node)))
+
+def ast_loads(data, key=None):
+  file_key, graph = read_header(data, key)
+  return decode_graph(graph)
+
+def ast_dump(node, path, key=""):
+  with open(path, "wb") as file:
+    file.write(ast_dumps(node, key))
+
+def ast_load(path, key=None):
+  with open(path, "rb") as file:
+    return ast_loads(file.read(), key)
+
+class CompiledModule:
+  def __init__(self, data, key=None):
+    self.key, self.interface_graph, self.code, self.ast_graph = read_header(data, key)
+  
+  def interface(self):
+    structs, fns = decode_graph(self.interface_graph)
+    return (structs, fns)
+  
+  def ast(self):
+    return decode_graph(self.ast_graph)
+
+def module_dump(path, key, interface, code, node):
+  structs, fns = interface
+  data = marshal.dumps((key, encode_graph([ structs, fns ]), code, encode_graph(node)))
+  
+  with open(path, "wb") as file:
+    file.write(serial_header + data)
+
+def module_load(path, key=None):
+  with open(path, "rb") as file:
+    return CompiledModule(file.read(), key)
@@ -0,0 +1,191 @@
+from asm import AsmError
+
+# three-address code for the register VM. every instruction is a 4-tuple
+# (op, a, b, c) where register operands index the frame's register file.
+tac_names = [
+  "label",
+  "li", "mov", "neg",
+  "add", "sub", "mul", "div", "addi",
+  "lt", "le", "gt", "ge", "eq", "ne",
+  "lea", "ld", "st", "ldl", "stl", "copy",
+  "jmp", "blt", "ble", "bgt", "bge", "beq", "bne",
+  "enter", "call", "ret", "tailcall", "print"
+]
+
+tac_code = { name: code for code, name in enumerate(tac_names) }
+
+tac_label = tac_code["label"]
+tac_li = tac_code["li"]
+tac_mov = tac_code["mov"]
+tac_neg = tac_code["neg"]
+tac_add = tac_code["add"]
+tac_sub = tac_code["sub"]
+tac_mul = tac_code["mul"]
+tac_div = tac_code["div"]
+tac_addi = tac_code["addi"]
+tac_lt = tac_code["lt"]
+tac_le = tac_code["le"]
+tac_gt = tac_code["gt"]
+tac_ge = tac_code["ge"]
+tac_eq = tac_code["eq"]
+tac_ne = tac_code["ne"]
+tac_lea = tac_code["lea"]
+tac_ld = tac_code["ld"]
+tac_st = tac_code["st"]
+tac_ldl = tac_code["ldl"]
+tac_stl = tac_code["stl"]
+tac_copy = tac_code["copy"]
+tac_jmp = tac_code["jmp"]
+tac_blt = tac_code["blt"]
+tac_ble = tac_code["ble"]
+tac_bgt = tac_code["bgt"]
+tac_bge = tac_code["bge"]
+tac_beq = tac_code["beq"]
+tac_bne = tac_code["bne"]
+tac_enter = tac_code["enter"]
+tac_call = tac_code["call"]
+tac_ret = tac_code["ret"]
+tac_tailcall = tac_code["tailcall"]
+tac_print = tac_code["print"]
+
+# conditional branches keep their target in c
+tac_branch = { tac_blt, tac_ble, tac_bgt, tac_bge, tac_beq, tac_bne }
+
+# li d k; lea d off; ldl d off; stl s off; addi d s k; ld d s off; st s d off;
+# copy d s size; enter size template args; call d label args; ret s;
+# tailcall _ label args. enter
+# gives the frame size, the initial register file and how many registers
+# arguments land in.
+def tac_text(instr):
+  op, a, b, c = instr
+  
+  if op == tac_label:
+    return f'__{a}'
+  elif op == tac_enter:
+    return f'enter {a} {len(b)}'
+  elif op == tac_call or op == tac_tailcall:
+    args = ", ".join([ f'r{r}' for r in c ])
+    dst = f'r{a} ' if a is not None else ''
+    return f'{tac_names[op]} {dst}{b} ({args})'
+  elif op == tac_jmp:
+    return f'jmp {a}'
+  elif op == tac_ret:
+    return f'ret r{a}' if a is not None else 'ret'
+  elif op == tac_print:
+    return f'print r{a}'
+  elif op in tac_branch:
+    return f'{tac_names[op]} r{a} r{b} {c}'
+  elif op in (tac_li, tac_lea, tac_ldl):
+    return f'{tac_names[op]} r{a} {b}'
+  elif op == tac_stl:
+    return f'stl r{a} {b}'
+  elif op in (tac_addi, tac_ld, tac_st, tac_copy):
+    return f'{tac_names[op]} r{a} r{b} {c}'
+  elif op in (tac_mov, tac_neg):
+    return f'{tac_names[op]} r{a} r{b}'
+  else:
+    return f'{tac_names[op]} r{a} r{b} r{c}'
+
+# a linked TAC program. jumps, branches and calls hold instruction offsets;
+# the symbol table only names them when disassembling.
+class TacProgram:
+  def __init__(self, code, symbols, entry):
+    self.code = code
+    self.symbols = symbols
+    self.entry = entry
+  
+  def disassemble(self):
+    return tac_disassemble(self.code, self.symbols)
+
+# resolve labels to instruction offsets. labels are dropped from the stream.
+def tac_assemble(code, entry="label_main"):
+  out = []
+  labels = {}
+  
+  for instr in code:
+    if instr[0] == tac_label:
+      labels[instr[1]] = len(out)
+    else:
+      out.append(instr)
+  
+  def resolve(target):
+    if target not in labels:
+      raise AsmError(f"undefined label '{target}'")
+    
+    return labels[target]
+  
+  for n, (op, a, b, c) in enumerate(out):
+    if op == tac_jmp:
+      out[n] = (op, resolve(a), b, c)
+    elif op in tac_branch:
+      out[n] = (op, a, b, resolve(c))
+    elif op == tac_call or op == tac_tailcall:
+      out[n] = (op, a, resolve(b), c)
+  
+  return TacProgram(out, labels, resolve(entry))
+
+def tac_disassemble(code, labels):
+  names = { pos: label for label, pos in labels.items() }
+  lines = []
+  
+  for n, (op, a, b, c) in enumerate(code):
+    if op == tac_jmp:
+      a = names.get(a, a)
+    elif op in tac_branch:
+      c = names.get(c, c)
+    elif op == tac_call or op == tac_tailcall:
+      b = names.get(b, b)
+    
+    lines.append(f'{n} {tac_text((op, a, b, c))}')
+  
+  return lines
+
+# instructions that only write their destination register
+tac_pure = {
+  tac_li, tac_mov, tac_neg, tac_add, tac_sub, tac_mul, tac_div, tac_addi,
+  tac_lt, tac_le, tac_gt, tac_ge, tac_eq, tac_ne, tac_lea, tac_ld, tac_ldl
+}
+
+tac_binary = { tac_add, tac_sub, tac_mul, tac_div, tac_lt, tac_le, tac_gt, tac_ge, tac_eq, tac_ne }
+
+# the register an instruction writes, or None
+def tac_def(instr):
+  op, a, b, c = instr
+  
+  if op in tac_pure or op == tac_call:
+    return a
+  
+  return None
+
+def tac_uses(instr):
+  op, a, b, c = instr
+  
+  if op in tac_binary:
+    return (b, c)
+  elif op in (tac_mov, tac_neg, tac_addi, tac_ld):
+    return (b,)
+  elif op in tac_branch or op in (tac_st, tac_copy):
+    return (a, b)
+  elif op == tac_stl or op == tac_print or (op == tac_ret and a is not None):
+    return (a,)
+  elif op == tac_call or op == tac_tailcall:
+    return c
+  
+  return ()
+
+# rewrite the registers an instruction reads
+def tac_rename(instr, names):
+  op, a, b, c = instr
+  
+  if op in tac_binary:
+    return (op, a, names.get(b, b), names.get(c, c))
+  elif op in (tac_mov, tac_neg, tac_addi, tac_ld):
+    return (op, a, names.get(b, b), c)
+  elif op in tac_branch or op in (tac_st, tac_copy):
+    return (op, names.get(a, a), names.get(b, b), c)
+  elif op == tac_stl or op == tac_print or (op == tac_ret and a is not None):
+    return (op, names.get(a, a), b, c)
+  elif op == tac_call or op == tac_tailcall:
+    return (op, a, b, tuple([ names.get(r, r) for r in c ]))
+  
+  return instr
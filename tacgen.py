@@ -0,0 +1,497 @@
+from ast import *
+from tac import *
+from helper import Dispatch
+from optimize import scope_vars, frame_escapes
+
+arith_ops = { "+": tac_add, "-": tac_sub, "*": tac_mul, "/": tac_div }
+cmp_ops = { "<": tac_lt, "<=": tac_le, ">": tac_gt, ">=": tac_ge, "==": tac_eq, "!=": tac_ne }
+
+# branch when the comparison holds, and when it does not
+true_branch = { "<": tac_blt, "<=": tac_ble, ">": tac_bgt, ">=": tac_bge, "==": tac_beq, "!=": tac_bne }
+false_branch = { "<": tac_bge, "<=": tac_bgt, ">": tac_ble, ">=": tac_blt, "==": tac_bne, "!=": tac_beq }
+
+def word_type(var_type):
+  return var_type is type_int or isinstance(var_type, TypePointer)
+
+# lowers the typed AST to three-address code over virtual registers. int and
+# pointer locals whose address is never taken live in registers, everything
+# else stays in the frame. an expression evaluates to the register holding
+# its value, or its address for structs and arrays.
+class TacGen:
+  def __init__(self, node=None, module=None, inits=[]):
+    self.code = []
+    self.module = module
+    self.inits = inits
+    self.lbl_prefix = f'{module}:' if module else ''
+    self.lbl_unit = f'{self.lbl_prefix}label'
+    self.lbl_name = 0
+    self.lbl_main = f'{self.lbl_prefix}label_main'
+    self.shared = set()
+    
+    self.stmt_rule = Dispatch("tac_stmt", {
+      AstPrintStmt: self.gen_print_stmt,
+      AstReturnStmt: self.gen_return_stmt,
+      AstIfStmt: self.gen_if_stmt,
+      AstWhileStmt: self.gen_while_stmt,
+      AstForStmt: self.gen_for_stmt,
+      AstStmt: self.gen_expr_stmt
+    })
+    
+    self.expr_rule = Dispatch("tac_expr", {
+      AstExpr: self.gen_bracket,
+      AstBinop: self.gen_binop,
+      AstUnaryOp: self.gen_unary_op,
+      AstConstant: self.gen_constant,
+      AstCall: self.gen_call,
+      AstIdentifier: self.gen_identifier,
+      AstIndex: self.gen_value,
+      AstAccess: self.gen_value
+    })
+    
+    self.addr_rule = Dispatch("tac_addr", {
+      AstExpr: lambda node: self.gen_addr(node.body),
+      AstIdentifier: self.gen_addr_identifier,
+      AstIndex: self.gen_addr_index,
+      AstUnaryOp: self.gen_addr_deref,
+      AstAccess: self.gen_addr_access
+    })
+    
+    if node:
+      self.gen_body(node.body)
+  
+  def gen_body(self, node):
+    fns = [ fn for fn in node.scope.var.values() if isinstance(fn, AstFunc) and fn.body ]
+    
+    # names a function reads from an enclosing frame have to stay in memory
+    for fn in fns:
+      local = { var for scope, name, var in scope_vars(fn.body.scope) }
+      
+      for expr in ast_walk(fn.body):
+        if isinstance(expr, AstIdentifier) and expr.decl not in local:
+          self.shared.add(expr.decl)
+    
+    for fn in fns:
+      self.gen_func(fn)
+    
+    self.gen_main(node)
+  
+  def begin_unit(self, body):
+    self.scope = body.scope
+    self.lbl_name = 0
+    self.nregs = 0
+    self.consts = {}
+    self.temps = []
+    self.temp_n = 0
+    self.extra = 0
+    self.args = 0
+    self.var_reg = {}
+    
+    taken = set()
+    
+    for expr in ast_walk(body):
+      if isinstance(expr, AstUnaryOp) and expr.op == '&' and isinstance(expr.body, AstIdentifier):
+        taken.add(expr.body.decl)
+    
+    self.promoted = {
+      var for scope, name, var in scope_vars(self.scope)
+      if word_type(var.var_type) and var not in taken and var not in self.shared
+    }
+    
+    self.enter = len(self.code)
+    self.emit(tac_enter)
+  
+  # the register file starts out holding the unit's constants
+  def end_unit(self):
+    template = [0] * self.nregs
+    
+    for value, r in self.consts.items():
+      template[r] = value
+    
+    self.code[self.enter] = (tac_enter, self.scope.size + self.extra, template, self.args)
+  
+  def gen_main(self, node):
+    self.lbl_unit = f'{self.lbl_prefix}label'
+    self.sret = None
+    self.tail_calls = False
+    
+    self.emit_label(self.lbl_main)
+    self.begin_unit(node)
+    
+    for init in self.inits:
+      self.emit(tac_call, None, init, ())
+    
+    for stmt in node.body:
+      self.gen_stmt(stmt)
+    
+    if self.module:
+      self.emit(tac_ret)
+    
+    self.end_unit()
+  
+  def gen_func(self, fn):
+    fn.label = f'{self.lbl_prefix}fn.{fn.name.text}'
+    self.lbl_unit = fn.label
+    
+    self.emit_label(fn.label)
+    self.begin_unit(fn.body)
+    
+    # arguments arrive in the first registers, then the address a struct
+    # result is returned through
+    params = [ self.reg() for param in fn.params ]
+    self.sret = self.reg() if fn.var_type and not word_type(fn.var_type) else None
+    self.args = self.nregs
+    self.tail_calls = self.sret is None and not frame_escapes(fn)
+    
+    for param, r in zip(fn.params, params):
+      if param in self.promoted:
+        self.var_reg[param] = r
+      elif word_type(param.var_type):
+        self.emit(tac_stl, r, param.loc)
+      else:
+        t = self.temp()
+        self.emit(tac_lea, t, param.loc)
+        self.emit(tac_copy, t, r, type_sizeof(param.var_type))
+    
+    self.gen_compound_stmt(fn.body)
+    
+    if not fn.body.body or not isinstance(fn.body.body[-1], AstReturnStmt):
+      self.emit(tac_ret)
+    
+    self.end_unit()
+  
+  def gen_stmt(self, node):
+    self.temp_n = 0
+    self.stmt_rule[type(node)](node)
+  
+  def gen_expr_stmt(self, node):
+    self.gen_expr(node.body)
+  
+  def gen_compound_stmt(self, node):
+    for stmt in node.body:
+      self.gen_stmt(stmt)
+  
+  def gen_print_stmt(self, node):
+    self.emit(tac_print, self.gen_expr(node.body))
+  
+  def gen_return_stmt(self, node):
+    call = node.body.body if isinstance(node.body, AstExpr) else node.body
+    
+    # struct arguments are copied out of the caller's frame on entry, so
+    # those calls keep their own frame
+    if (
+      self.tail_calls and isinstance(call, AstCall) and
+      all([ word_type(arg.var_type) for arg in call.args ])
+    ):
+      args = tuple([ self.gen_expr(arg) for arg in call.args ])
+      self.emit(tac_tailcall, None, call.base.decl.label, args)
+    elif not node.body:
+      self.emit(tac_ret)
+    elif self.sret is not None:
+      src = self.gen_expr(node.body)
+      self.emit(tac_copy, self.sret, src, type_sizeof(node.body.var_type))
+      self.emit(tac_ret, self.sret)
+    else:
+      self.emit(tac_ret, self.gen_expr(node.body))
+  
+  def gen_if_stmt(self, node):
+    lbl_end = self.label()
+    
+    self.gen_cond(node.cond, lbl_end, False)
+    self.gen_compound_stmt(node.body)
+    self.emit_label(lbl_end)
+  
+  # loops test at the bottom so an iteration takes one branch
+  def gen_while_stmt(self, node):
+    lbl_body = self.label()
+    lbl_cond = self.label()
+    
+    self.emit(tac_jmp, lbl_cond)
+    self.emit_label(lbl_body)
+    self.gen_compound_stmt(node.body)
+    self.emit_label(lbl_cond)
+    self.temp_n = 0
+    self.gen_cond(node.cond, lbl_body, True)
+  
+  def gen_for_stmt(self, node):
+    for stmt in node.init:
+      self.gen_stmt(stmt)
+    
+    lbl_body = self.label()
+    lbl_cond = self.label()
+    
+    self.emit(tac_jmp, lbl_cond)
+    self.emit_label(lbl_body)
+    self.gen_compound_stmt(node.body)
+    self.temp_n = 0
+    self.gen_expr(node.step)
+    self.emit_label(lbl_cond)
+    self.temp_n = 0
+    self.gen_cond(node.cond, lbl_body, True)
+  
+  # branch to label when the condition is (when=True) or is not true
+  def gen_cond(self, node, label, when):
+    if isinstance(node, AstExpr):
+      node = node.body
+    
+    if isinstance(node, AstBinop) and node.op in cmp_ops:
+      lhs = self.gen_expr(node.lhs)
+      rhs = self.gen_expr(node.rhs)
+      branch = true_branch if when else false_branch
+      self.emit(branch[node.op], lhs, rhs, label)
+    else:
+      value = self.gen_expr(node)
+      self.emit(tac_bne if when else tac_beq, value, self.const(0), label)
+  
+  def gen_expr(self, node, dst=None):
+    return self.expr_rule[type(node)](node, dst)
+  
+  def gen_bracket(self, node, dst):
+    return self.gen_expr(node.body, dst)
+  
+  def gen_constant(self, node, dst):
+    if dst is None:
+      return self.const(node.value)
+    
+    self.emit(tac_li, dst, node.value)
+    return dst
+  
+  def gen_identifier(self, node, dst):
+    if node.decl in self.promoted:
+      return self.into(self.var_register(node.decl), dst)
+    
+    return self.gen_value(node, dst)
+  
+  def gen_value(self, node, dst):
+    base, off = self.gen_addr(node)
+    
+    if not word_type(node.var_type):
+      return self.addr_reg(base, off, dst)
+    
+    dst = self.dest(dst)
+    
+    if base is None:
+      self.emit(tac_ldl, dst, off)
+    else:
+      self.emit(tac_ld, dst, base, off)
+    
+    return dst
+  
+  def gen_unary_op(self, node, dst):
+    if node.op == '-':
+      value = self.gen_expr(node.body)
+      dst = self.dest(dst)
+      self.emit(tac_neg, dst, value)
+      return dst
+    elif node.op == '&':
+      base, off = self.gen_addr(node.body)
+      return self.addr_reg(base, off, dst)
+    elif node.op == '*':
+      return self.gen_value(node, dst)
+    else:
+      raise Exception("IDK THIS")
+  
+  def gen_call(self, node, dst):
+    fn = node.base.decl
+    args = [ self.gen_expr(arg) for arg in node.args ]
+    
+    if fn.var_type and not word_type(fn.var_type):
+      args.append(self.addr_reg(None, self.alloc_extra(fn.var_type)))
+    
+    if fn.var_type:
+      dst = self.dest(dst)
+    
+    self.emit(tac_call, dst, fn.label, tuple(args))
+    return dst
+  
+  def gen_binop(self, node, dst):
+    lhs_type = node.lhs.var_type
+    
+    if lhs_type is not node.rhs.var_type:
+      raise Exception("IDK!!!")
+    
+    if node.op == "=":
+      return self.gen_assign(node, dst)
+    elif not word_type(lhs_type):
+      raise Exception("IDK!!!")
+    elif node.op in assign_ops:
+      return self.gen_update(node, dst)
+    elif node.op in cmp_ops:
+      lhs = self.gen_expr(node.lhs)
+      rhs = self.gen_expr(node.rhs)
+      dst = self.dest(dst)
+      self.emit(cmp_ops[node.op], dst, lhs, rhs)
+      return dst
+    elif node.op in arith_ops:
+      lhs = self.gen_expr(node.lhs)
+      return self.gen_arith(node.op, lhs, node.rhs, self.dest(dst))
+    else:
+      raise Exception("I DONT KNOW THIS ONE!!!")
+  
+  def gen_arith(self, op, lhs, rhs, dst):
+    if isinstance(rhs, AstConstant) and op in ("+", "-"):
+      self.emit(tac_addi, dst, lhs, rhs.value if op == "+" else -rhs.value)
+    else:
+      self.emit(arith_ops[op], dst, lhs, self.gen_expr(rhs))
+    
+    return dst
+  
+  def gen_assign(self, node, dst):
+    if isinstance(node.lhs, AstIdentifier) and node.lhs.decl in self.promoted:
+      var = self.var_register(node.lhs.decl)
+      return self.into(self.into(self.gen_expr(node.rhs, var), var), dst)
+    
+    value = self.gen_expr(node.rhs)
+    base, off = self.gen_addr(node.lhs)
+    
+    if word_type(node.var_type):
+      self.store(value, base, off)
+      return self.into(value, dst)
+    
+    target = self.addr_reg(base, off, dst)
+    self.emit(tac_copy, target, value, type_sizeof(node.var_type))
+    
+    return target
+  
+  # the target is evaluated once, as in the stack backend
+  def gen_update(self, node, dst):
+    op = node.op[:-1]
+    
+    if isinstance(node.lhs, AstIdentifier) and node.lhs.decl in self.promoted:
+      var = self.var_register(node.lhs.decl)
+      return self.into(self.gen_arith(op, var, node.rhs, var), dst)
+    
+    base, off = self.gen_addr(node.lhs)
+    value = self.temp()
+    
+    if base is None:
+      self.emit(tac_ldl, value, off)
+    else:
+      self.emit(tac_ld, value, base, off)
+    
+    self.gen_arith(op, value, node.rhs, value)
+    self.store(value, base, off)
+    
+    return self.into(value, dst)
+  
+  # (base register, offset), where no base register means the frame
+  def gen_addr(self, node):
+    return self.addr_rule[type(node)](node)
+  
+  def gen_addr_identifier(self, node):
+    if node.decl in self.promoted:
+      raise Exception("gen error: not lvalue")
+    
+    return None, node.decl.loc
+  
+  def gen_addr_index(self, node):
+    size = type_sizeof(node.var_type)
+    
+    if isinstance(node.base.var_type, TypeArray):
+      base, off = self.gen_addr(node.base)
+    else:
+      base, off = self.gen_pointer(node.base)
+    
+    if isinstance(node.pos, AstConstant):
+      return base, off + node.pos.value * size
+    
+    pos = self.temp()
+    self.emit(tac_mul, pos, self.gen_expr(node.pos), self.const(size))
+    
+    if base is None:
+      base = self.temp()
+      self.emit(tac_lea, base, 0)
+    
+    addr = self.temp()
+    self.emit(tac_add, addr, pos, base)
+    
+    return addr, off
+  
+  def gen_addr_deref(self, node):
+    if node.op != '*':
+      raise Exception("gen error: not lvalue")
+    
+    return self.gen_pointer(node.body)
+  
+  def gen_addr_access(self, node):
+    if node.direct:
+      base, off = self.gen_addr(node.base)
+      return base, off + node.member.loc
+    
+    base, off = self.gen_pointer(node.base)
+    return base, off + node.member.loc
+  
+  # a pointer taken with & is addressed through what it points at
+  def gen_pointer(self, node):
+    if isinstance(node, AstUnaryOp) and node.op == '&':
+      return self.gen_addr(node.body)
+    
+    return self.gen_expr(node), 0
+  
+  def addr_reg(self, base, off, dst=None):
+    if base is None:
+      dst = self.dest(dst)
+      self.emit(tac_lea, dst, off)
+    elif off != 0:
+      dst = self.dest(dst)
+      self.emit(tac_addi, dst, base, off)
+    else:
+      return self.into(base, dst)
+    
+    return dst
+  
+  def store(self, value, base, off):
+    if base is None:
+      self.emit(tac_stl, value, off)
+    else:
+      self.emit(tac_st, value, base, off)
+  
+  # frame space past the locals, for struct results
+  def alloc_extra(self, var_type):
+    align = type_alignof(var_type)
+    loc = (self.scope.size + self.extra + align - 1) // align * align
+    self.extra = loc + type_sizeof(var_type) - self.scope.size
+    return loc
+  
+  def var_register(self, var):
+    if var not in self.var_reg:
+      self.var_reg[var] = self.reg()
+    
+    return self.var_reg[var]
+  
+  def const(self, value):
+    if value not in self.consts:
+      self.consts[value] = self.reg()
+    
+    return self.consts[value]
+  
+  def reg(self):
+    self.nregs += 1
+    return self.nregs - 1
+  
+  # temporaries are reused from one statement to the next
+  def temp(self):
+    if self.temp_n == len(self.temps):
+      self.temps.append(self.reg())
+    
+    self.temp_n += 1
+    return self.temps[self.temp_n - 1]
+  
+  def dest(self, dst):
+    return dst if dst is not None else self.temp()
+  
+  def into(self, value, dst):
+    if dst is None or dst == value:
+      return value
+    
+    self.emit(tac_mov, dst, value)
+    return dst
+  
+  def label(self):
+    self.lbl_name += 1
+    return f'{self.lbl_unit}_{self.lbl_name}'
+  
+  def emit_label(self, label):
+    self.code.append((tac_label, label, None, None))
+  
+  def emit(self, op, a=None, b=None, c=None):
+    self.code.append((op, a, b, c))
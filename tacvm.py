@@ -0,0 +1,152 @@
+from tac import *
+
+class TacVM:
+  def __init__(self, program, stack_size=65536):
+    self.program = program
+    self.stack = [0] * stack_size
+    self.frame = []
+    self.regs = None
+    self.pc = 0
+    self.sp = 0
+    self.fp = 0
+  
+  def dump(self):
+    for label, pos in self.program.symbols.items():
+      print(f'{label}: {pos}')
+    
+    for line in self.program.disassemble():
+      print(line)
+  
+  def run(self):
+    code = self.program.code
+    stack = self.stack
+    frame = self.frame
+    
+    pc = self.program.entry
+    sp = self.sp
+    fp = self.fp
+    regs = self.regs
+    size = len(code)
+    
+    while pc < size:
+      op, a, b, c = code[pc]
+      
+      if op == tac_add:
+        regs[a] = regs[b] + regs[c]
+      elif op == tac_addi:
+        regs[a] = regs[b] + c
+      elif op == tac_ld:
+        regs[a] = stack[(regs[b] + c) >> 2]
+      elif op == tac_st:
+        stack[(regs[b] + c) >> 2] = regs[a]
+      elif op == tac_ldl:
+        regs[a] = stack[(fp + b) >> 2]
+      elif op == tac_stl:
+        stack[(fp + b) >> 2] = regs[a]
+      elif op == tac_blt:
+        if regs[a] < regs[b]:
+          pc = c
+          continue
+      elif op == tac_bge:
+        if regs[a] >= regs[b]:
+          pc = c
+          continue
+      elif op == tac_ble:
+        if regs[a] <= regs[b]:
+          pc = c
+          continue
+      elif op == tac_bgt:
+        if regs[a] > regs[b]:
+          pc = c
+          continue
+      elif op == tac_beq:
+        if regs[a] == regs[b]:
+          pc = c
+          continue
+      elif op == tac_bne:
+        if regs[a] != regs[b]:
+          pc = c
+          continue
+      elif op == tac_jmp:
+        pc = a
+        continue
+      elif op == tac_mul:
+        regs[a] = regs[b] * regs[c]
+      elif op == tac_sub:
+        regs[a] = regs[b] - regs[c]
+      elif op == tac_div:
+        regs[a] = regs[b] // regs[c]
+      elif op == tac_mov:
+        regs[a] = regs[b]
+      elif op == tac_li:
+        regs[a] = b
+      elif op == tac_lea:
+        regs[a] = fp + b
+      elif op == tac_neg:
+        regs[a] = -regs[b]
+      elif op == tac_lt:
+        regs[a] = 1 if regs[b] < regs[c] else 0
+      elif op == tac_le:
+        regs[a] = 1 if regs[b] <= regs[c] else 0
+      elif op == tac_gt:
+        regs[a] = 1 if regs[b] > regs[c] else 0
+      elif op == tac_ge:
+        regs[a] = 1 if regs[b] >= regs[c] else 0
+      elif op == tac_eq:
+        regs[a] = 1 if regs[b] == regs[c] else 0
+      elif op == tac_ne:
+        regs[a] = 1 if regs[b] != regs[c] else 0
+      elif op == tac_copy:
+        dst = regs[a] >> 2
+        src = regs[b] >> 2
+        n = c >> 2
+        stack[dst:dst + n] = stack[src:src + n]
+      elif op == tac_call:
+        # the callee's enter gives its frame size and initial register file.
+        # arguments land in its first registers.
+        _, frame_size, template, _ = code[b]
+        callee = list(template)
+        
+        for n, r in enumerate(c):
+          callee[n] = regs[r]
+        
+        frame.append((pc, regs, fp, a))
+        regs = callee
+        fp = sp
+        sp += frame_size
+        pc = b + 1
+        continue
+      elif op == tac_ret:
+        value = regs[a] if a is not None else None
+        sp = fp
+        pc, regs, fp, dst = frame.pop()
+        
+        if dst is not None:
+          regs[dst] = value
+      elif op == tac_tailcall:
+        # the callee takes over this frame and returns to our caller
+        _, frame_size, template, _ = code[b]
+        callee = list(template)
+        
+        for n, r in enumerate(c):
+          callee[n] = regs[r]
+        
+        regs = callee
+        sp = fp + frame_size
+        pc = b + 1
+        continue
+      elif op == tac_enter:
+        regs = list(b)
+        fp = sp
+        sp += a
+      elif op == tac_print:
+        print(">", regs[a])
+      else:
+        print(tac_names[op])
+      
+      pc += 1
+    
+    self.pc = pc
+    self.sp = sp
+    self.fp = fp
+    self.regs = regs
@@ -1,28 +1,22 @@
+from asm import *
 
 class VM:
-  def __init__(self, code):
-    self.opc = []
-    self.lbl = {}
-    self.stack = [0] * 16
+  def __init__(self, program, stack_size=65536):
+    self.program = program
+    self.stack = [0] * stack_size
     self.frame = []
     self.call = []
     self.arg = []
     self.pc = 0
     self.sp = 0
     self.fp = 0
-    
-    for line in code:
-      if line.startswith("__"):
-        self.lbl[line[2:]] = len(self.opc)
-      else:
-        self.opc.append(line)
   
   def dump(self):
-    for label, pos in self.lbl.items():
+    for label, pos in self.program.symbols.items():
       print(f'{label}: {pos}')
     
-    for n, opc in zip(range(len(self.opc)), self.opc):
-      print(n, opc)
+    for line in self.program.disassemble():
+      print(line)
   
   def push(self, n):
     self.stack[self.sp // 4] = n
@@ -33,107 +27,228 @@ class VM:
     return self.stack[self.sp // 4]
   
   def run(self):
-    self.pc = self.lbl['label_main']
+    ops = self.program.ops
+    operands = self.program.operands
+    stack = self.stack
+    frame = self.frame
+    call = self.call
+    arg = self.arg
     
-    while self.pc < len(self.opc):
-      args = self.opc[self.pc].split()
+    pc = self.program.entry
+    sp = self.sp
+    fp = self.fp
+    size = len(ops)
+    
+    while pc < size:
+      op = ops[pc]
       
-      if args[0] == "push":
-        self.push(int(args[1]))
-      elif args[0] == "pop":
-        self.pop()
-      elif args[0] == "rx":
-        registers = {
-          "$fp": self.fp,
-          "$sp": self.sp,
-          "$pc": self.pc
-        }
-        self.push(registers[args[1]])
-      elif args[0] == "add":
-        b = self.pop()
-        a = self.pop()
-        self.push(a + b)
-      elif  args[0] == "sub":
-        b = self.pop()
-        a = self.pop()
-        self.push(a - b)
-      elif args[0] == "mul":
-        b = self.pop()
-        a = self.pop()
-        self.push(a * b)
-      elif args[0] == "div":
-        b = self.pop()
-        a = self.pop()
-        self.push(a // b)
-      elif args[0] == "jle":
-        b = self.pop()
-        a = self.pop()
-        if a <= b:
-          self.pc = self.lbl[args[1]] - 1
-      elif args[0] == "jge":
-        b = self.pop()
-        a = self.pop()
-        if a >= b:
-          self.pc = self.lbl[args[1]] - 1
-      elif args[0] == "jlt":
-        b = self.pop()
-        a = self.pop()
-        if a < b:
-          self.pc = self.lbl[args[1]] - 1
-      elif args[0] == "jgt":
-        b = self.pop()
-        a = self.pop()
-        if a > b:
-          self.pc = self.lbl[args[1]] - 1
-      elif args[0] == "jmp":
-        self.pc = self.lbl[args[1]] - 1
-      elif args[0] == "load":
-        n = int(args[1]) // 4
-        a = self.pop() // 4
-        for i in range(n):
-          self.push(self.stack[a + i])
-      elif args[0] == "store":
-        n = int(args[1]) // 4
-        a = self.pop() // 4
-        for i in range(n):
-          b = self.pop()
-          self.stack[a + n - i - 1] = b
-      elif args[0] == "frame":
-        a = int(args[1])
-        fp = self.fp
-        self.fp = self.sp
-        self.sp += a
-        self.frame.append(fp)
-      elif args[0] == "end":
-        a = self.frame.pop()
-        self.sp = self.fp
-        self.fp = a
-      elif args[0] == "call":
-        self.call.append(self.pc)
-        self.pc = self.lbl[args[1]] - 1
-        # print(self.arg)
-        # print(' '.join([ (f"[{x}]" if y == self.sp else f"{x}") for x, y in zip(self.stack, range(len(self.stack))) ]))
-      elif args[0] == "ret":
-        a = self.call.pop()
-        self.pc = a
-      elif args[0] == "arg":
-        n = int(args[1]) // 4
-        for i in range(n):
-          self.arg.append(self.pop())
-      elif args[0] == "param":
-        n = int(args[1]) // 4
-        for i in range(n):
-          self.push(self.arg.pop())
-      elif args[0] == "print":
-        b = self.pop()
-        print(">", b)
+      if op == op_lload:
+        stack[sp >> 2] = stack[(fp + operands[pc]) >> 2]
+        sp += 4
+      elif op == op_lstore:
+        sp -= 4
+        stack[(fp + operands[pc]) >> 2] = stack[sp >> 2]
+      elif op == op_push:
+        stack[sp >> 2] = operands[pc]
+        sp += 4
+      elif op == op_addi:
+        stack[(sp >> 2) - 1] += operands[pc]
+      elif op == op_ldm:
+        i = (sp >> 2) - 1
+        stack[i] = stack[(stack[i] + operands[pc]) >> 2]
+      elif op == op_stm:
+        sp -= 8
+        i = sp >> 2
+        stack[(stack[i + 1] + operands[pc]) >> 2] = stack[i]
+      elif op == op_linc:
+        off, n = operands[pc]
+        stack[(fp + off) >> 2] += n
+      elif op == op_lea:
+        stack[sp >> 2] = fp + operands[pc]
+        sp += 4
+      elif op == op_muli:
+        stack[(sp >> 2) - 1] *= operands[pc]
+      elif op == op_jlti:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] < imm:
+          pc = target
+          continue
+      elif op == op_jgei:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] >= imm:
+          pc = target
+          continue
+      elif op == op_jlei:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] <= imm:
+          pc = target
+          continue
+      elif op == op_jgti:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] > imm:
+          pc = target
+          continue
+      elif op == op_jeqi:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] == imm:
+          pc = target
+          continue
+      elif op == op_jnei:
+        sp -= 4
+        imm, target = operands[pc]
+        if stack[sp >> 2] != imm:
+          pc = target
+          continue
+      elif op == op_rx:
+        reg = operands[pc]
+        stack[sp >> 2] = fp if reg == reg_fp else sp if reg == reg_sp else pc
+        sp += 4
+      elif op == op_add:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] += stack[i]
+      elif op == op_load:
+        n = operands[pc] >> 2
+        i = (sp >> 2) - 1
+        a = stack[i] >> 2
+        stack[i:i + n] = stack[a:a + n]
+        sp += (n - 1) * 4
+      elif op == op_store:
+        n = operands[pc] >> 2
+        sp -= 4
+        i = sp >> 2
+        a = stack[i] >> 2
+        stack[a:a + n] = stack[i - n:i]
+        sp -= n * 4
+      elif op == op_mul:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] *= stack[i]
+      elif op == op_sub:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] -= stack[i]
+      elif op == op_div:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] //= stack[i]
+      elif op == op_pop:
+        sp -= 4
+      elif op == op_dup:
+        i = sp >> 2
+        stack[i] = stack[i - 1]
+        sp += 4
+      elif op == op_swap:
+        i = sp >> 2
+        stack[i - 1], stack[i - 2] = stack[i - 2], stack[i - 1]
+      elif op == op_jmp:
+        pc = operands[pc]
+        continue
+      elif op == op_jle:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] <= stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jge:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] >= stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jlt:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] < stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jgt:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] > stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jeq:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] == stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jne:
+        sp -= 8
+        i = sp >> 2
+        if stack[i] != stack[i + 1]:
+          pc = operands[pc]
+          continue
+      elif op == op_jz:
+        sp -= 4
+        if stack[sp >> 2] == 0:
+          pc = operands[pc]
+          continue
+      elif op == op_lt:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] < stack[i] else 0
+      elif op == op_le:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] <= stack[i] else 0
+      elif op == op_gt:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] > stack[i] else 0
+      elif op == op_ge:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] >= stack[i] else 0
+      elif op == op_eq:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] == stack[i] else 0
+      elif op == op_ne:
+        sp -= 4
+        i = sp >> 2
+        stack[i - 1] = 1 if stack[i - 1] != stack[i] else 0
+      elif op == op_frame:
+        frame.append(fp)
+        fp = sp
+        sp += operands[pc]
+      elif op == op_end:
+        sp = fp
+        fp = frame.pop()
+      elif op == op_call:
+        call.append(pc)
+        pc = operands[pc]
+        continue
+      elif op == op_ret:
+        pc = call.pop()
+      elif op == op_tailcall:
+        sp = fp
+        fp = frame.pop()
+        pc = operands[pc]
+        continue
+      elif op == op_arg:
+        n = operands[pc] >> 2
+        i = sp >> 2
+        arg.extend(reversed(stack[i - n:i]))
+        sp -= n * 4
+      elif op == op_param:
+        for _ in range(operands[pc] >> 2):
+          stack[sp >> 2] = arg.pop()
+          sp += 4
+      elif op == op_print:
+        sp -= 4
+        print(">", stack[sp >> 2])
       else:
-        print(args[0])
-      
-      # info = ' '.join([ (f"[{x}]" if y == self.sp // 4 else f"{x}") for x, y in zip(self.stack, range(len(self.stack))) ])
-      # print(self.pc, ' '.join(args), ">", f"$fp={self.fp}")
-      # print("  " + info)
+        print(op_names[op])
       
-      self.pc += 1
+      pc += 1
     
-    # print("$sp:", self.sp)
+    self.pc = pc
+    self.sp = sp
+    self.fp = fp